@@ -0,0 +1,322 @@
+"""
+AI 提示上下文 - 把近期的回球、健康打卡和赛事整理成按天的短摘要，在 token 预算内拼进提示
+
+写入：services 在写记录的同一事务里调用 summarize_*，增量更新当天那一行 daily_summaries。
+读取：build_prompt_context 从最近一天往前拼，预算不够时先省略近况、再把更早的日子合并成一行，
+所以历史再长，提示长度也基本不变。
+回填：旧数据库升级时由迁移自动执行一次（只从回球记录里取近况，归档库里的旧回球也算在内）。
+"""
+import heapq
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import String, case, cast, func, text
+from sqlalchemy.dialects.sqlite import insert
+
+from database import DailySummary, LoveRecord, MatchReminder, bump_table_versions, get_read_session, iter_archived
+from query_cache import cached_query
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CRUSHCOURT_AI_CONTEXT_TOKENS", "600"))
+CONTEXT_DAYS = 30  # 最多回看的天数
+UPCOMING_MATCHES = 3  # 附带的未完成赛事数
+HIGHLIGHTS_PER_DAY = 5  # 每天保留的近况条数
+HIGHLIGHT_CHARS = 24  # 每条近况截取的字数
+
+ACTION_LABELS = {"serve": "发球", "return": "回球", "smash": "扣杀", "drop": "放网"}
+
+_BACKFILL_SQL = """
+    INSERT INTO daily_summaries
+        (day, love_records, score_sum, health_checkins, matches_created, matches_completed, highlights, updated_at)
+    SELECT day, SUM(love), SUM(score), SUM(checkin), SUM(created), SUM(completed), '[]', CURRENT_TIMESTAMP
+    FROM (
+        SELECT date(created_at) AS day, 1 AS love, COALESCE(emotion_score, 0) AS score,
+               0 AS checkin, 0 AS created, 0 AS completed
+        FROM love_records WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT date(completed_at), 0, 0, 1, 0, 0 FROM health_logs WHERE completed_at IS NOT NULL
+        UNION ALL
+        SELECT date(created_at), 0, 0, 0, 1, 0 FROM match_reminders WHERE created_at IS NOT NULL
+        UNION ALL
+        SELECT date(match_date), 0, 0, 0, 0, 1
+        FROM match_reminders WHERE is_completed = 1 AND match_date IS NOT NULL
+    )
+    GROUP BY day
+"""
+
+_BACKFILL_HIGHLIGHTS_SQL = """
+    SELECT id, day, created_at, sender, action, content FROM (
+        SELECT id, date(created_at) AS day, sender, action, content, created_at,
+               ROW_NUMBER() OVER (PARTITION BY date(created_at) ORDER BY created_at DESC, id DESC) AS rn
+        FROM love_records WHERE created_at IS NOT NULL
+    )
+    WHERE rn <= :per_day
+"""
+
+_MERGE_ARCHIVED_SQL = """
+    INSERT INTO daily_summaries
+        (day, love_records, score_sum, health_checkins, matches_created, matches_completed, highlights, updated_at)
+    VALUES (:day, :love_records, :score_sum, 0, 0, 0, '[]', CURRENT_TIMESTAMP)
+    ON CONFLICT (day) DO UPDATE
+    SET love_records = love_records + excluded.love_records, score_sum = score_sum + excluded.score_sum
+"""
+
+
+def _who(user):
+    return "我" if user == "me" else "他"
+
+
+def _clip(value):
+    value = " ".join((value or "").split())
+    return value if len(value) <= HIGHLIGHT_CHARS else value[:HIGHLIGHT_CHARS] + "…"
+
+
+def _love_highlight(sender, action, content):
+    return f"{_who(sender)}{ACTION_LABELS.get(action, '发球')}：{_clip(content)}"
+
+
+def _summarize(session, when, highlight=None, **counters):
+    """在给定会话中累加当天的计数并追加一条近况，不提交（一条 INSERT ... ON CONFLICT DO UPDATE）。"""
+    values = {
+        "love_records": 0,
+        "score_sum": 0.0,
+        "health_checkins": 0,
+        "matches_created": 0,
+        "matches_completed": 0,
+        **counters,
+    }
+    stmt = insert(DailySummary).values(
+        day=when.date(),
+        highlights=json.dumps([highlight] if highlight else [], ensure_ascii=False),
+        updated_at=datetime.utcnow(),
+        **values,
+    )
+    set_ = {name: getattr(DailySummary, name) + stmt.excluded[name] for name in counters}
+    set_["updated_at"] = stmt.excluded.updated_at
+    if highlight:
+        # 追加到 JSON 列表末尾，超过 HIGHLIGHTS_PER_DAY 条时去掉最旧的一条
+        appended = func.json_insert(DailySummary.highlights, "$[#]", func.json_extract(stmt.excluded.highlights, "$[0]"))
+        set_["highlights"] = case(
+            (func.json_array_length(DailySummary.highlights) >= HIGHLIGHTS_PER_DAY, func.json_remove(appended, "$[0]")),
+            else_=appended,
+        )
+    session.execute(stmt.on_conflict_do_update(index_elements=[DailySummary.day], set_=set_))
+
+
+def summarize_love_record(session, record):
+    _summarize(
+        session,
+        record.created_at,
+        _love_highlight(record.sender, record.action, record.content),
+        love_records=1,
+        score_sum=record.emotion_score or 0.0,
+    )
+
+
+def summarize_health_log(session, log):
+    _summarize(
+        session,
+        log.completed_at,
+        f"{_who(log.user)}健康打卡：{_clip(log.note)}" if log.note else None,
+        health_checkins=1,
+    )
+
+
+def summarize_match(session, task, completed=False):
+    if completed:
+        # 与回填一样记在比赛那天，而不是点“完成”的那天
+        _summarize(session, task.match_date, f"完成赛事：{_clip(task.title)}", matches_completed=1)
+    else:
+        _summarize(
+            session,
+            task.created_at,
+            f"新赛事：{_clip(task.title)}（{task.match_date:%m-%d %H:%M}）",
+            matches_created=1,
+        )
+
+
+def backfill_daily_summaries(connection, rebuild=False):
+    """用已有记录（含归档库里的回球）重建每日摘要；rebuild=False 时只在摘要表为空时执行。"""
+    if rebuild:
+        connection.execute(text("DELETE FROM daily_summaries"))
+    elif connection.execute(text("SELECT 1 FROM daily_summaries LIMIT 1")).first():
+        return
+    connection.execute(text(_BACKFILL_SQL))
+
+    # 每天最新的几条近况：主库和归档库的候选放进同一个按 (created_at, id) 排序的小顶堆
+    candidates = {}
+
+    def offer(record_id, day, created_at, sender, action, content):
+        heap = candidates.setdefault(day, [])
+        item = (created_at, record_id, _love_highlight(sender, action, content))
+        if len(heap) < HIGHLIGHTS_PER_DAY:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    for row in connection.execute(text(_BACKFILL_HIGHLIGHTS_SQL), {"per_day": HIGHLIGHTS_PER_DAY}):
+        offer(*row)
+
+    table = LoveRecord.__table__
+    archived = {}
+    for row in iter_archived(
+        connection,
+        table,
+        [
+            func.date(table.c.created_at),
+            cast(table.c.created_at, String),  # 与主库查询一样按存储的字符串比较先后
+            table.c.sender,
+            table.c.action,
+            table.c.content,
+            table.c.emotion_score,
+        ],
+    ):
+        record_id, day, created_at, sender, action, content, score = row
+        if day is None:
+            continue
+        counts = archived.setdefault(day, [0, 0.0])
+        counts[0] += 1
+        counts[1] += score or 0.0
+        offer(record_id, day, created_at, sender, action, content)
+    if archived:
+        connection.execute(
+            text(_MERGE_ARCHIVED_SQL),
+            [{"day": day, "love_records": n, "score_sum": total} for day, (n, total) in archived.items()],
+        )
+
+    for day, heap in candidates.items():
+        connection.execute(
+            text("UPDATE daily_summaries SET highlights = :highlights WHERE day = :day"),
+            {"day": day, "highlights": json.dumps([item[2] for item in sorted(heap)], ensure_ascii=False)},
+        )
+    bump_table_versions(connection, ["daily_summaries"])
+
+
+def estimate_tokens(value: str) -> int:
+    """粗略估算 token 数：中文等非 ASCII 字符按 1 个算，ASCII 按 4 个字符 1 个算。"""
+    wide = sum(1 for ch in value if ord(ch) > 127)
+    return wide + (len(value) - wide + 3) // 4
+
+
+@cached_query("daily_summaries")
+def get_daily_summaries(days=CONTEXT_DAYS):
+    """最近 N 天（含今天）的摘要，最新的在前。"""
+    start = date.today() - timedelta(days=days - 1)
+    session = get_read_session()
+    try:
+        return (
+            session.query(DailySummary)
+            .filter(DailySummary.day >= start)
+            .order_by(DailySummary.day.desc())
+            .all()
+        )
+    finally:
+        session.close()
+
+
+@cached_query("match_reminders")
+def get_upcoming_matches(limit=UPCOMING_MATCHES):
+    session = get_read_session()
+    try:
+        return (
+            session.query(MatchReminder)
+            .filter(MatchReminder.is_completed.is_(False), MatchReminder.match_date >= datetime.now())
+            .order_by(MatchReminder.match_date.asc())
+            .limit(limit)
+            .all()
+        )
+    finally:
+        session.close()
+
+
+def _counts(love_records, score_sum, health_checkins, matches_created, matches_completed):
+    parts = []
+    if love_records:
+        parts.append(f"回球 {love_records} 条（情绪均分 {score_sum / love_records:.1f}）")
+    if health_checkins:
+        parts.append(f"健康打卡 {health_checkins} 次")
+    if matches_created:
+        parts.append(f"新建赛事 {matches_created} 场")
+    if matches_completed:
+        parts.append(f"完成赛事 {matches_completed} 场")
+    return "、".join(parts) or "无记录"
+
+
+def _day_lines(summary):
+    """一天的完整写法和省略近况的简短写法。"""
+    head = f"{summary.day:%m-%d}：" + _counts(
+        summary.love_records,
+        summary.score_sum,
+        summary.health_checkins,
+        summary.matches_created,
+        summary.matches_completed,
+    )
+    highlights = json.loads(summary.highlights or "[]")
+    full = f"{head}；近况：" + "；".join(reversed(highlights)) if highlights else head
+    return full, head
+
+
+def build_prompt_context(budget=CONTEXT_TOKEN_BUDGET, days=CONTEXT_DAYS) -> str:
+    """拼出不超过 budget 个 token（估算）的上下文文本；没有任何记录时返回空字符串。"""
+    lines = []
+    used = 0
+
+    def fits(line):
+        return used + estimate_tokens(line) + 1 <= budget
+
+    matches = get_upcoming_matches()
+    if matches:
+        line = "待进行赛事：" + "；".join(
+            f"{m.match_date:%m-%d %H:%M} {_clip(m.title)}（{m.location or '地点待定'}）" for m in matches
+        )
+        if fits(line):
+            lines.append(line)
+            used += estimate_tokens(line) + 1
+
+    summaries = get_daily_summaries(days)
+    header = f"最近 {days} 天情况（新的在前）："
+    if summaries and fits(header):
+        lines.append(header)
+        used += estimate_tokens(header) + 1
+
+        rest = list(summaries)
+        while rest:
+            full, short = _day_lines(rest[0])
+            line = full if fits(full) else short
+            if not fits(line):
+                break
+            lines.append(line)
+            used += estimate_tokens(line) + 1
+            rest.pop(0)
+
+        if rest:
+            # 放不下的更早日子合并成一行
+            line = f"更早 {len(rest)} 天合计：" + _counts(
+                sum(s.love_records for s in rest),
+                sum(s.score_sum for s in rest),
+                sum(s.health_checkins for s in rest),
+                sum(s.matches_created for s in rest),
+                sum(s.matches_completed for s in rest),
+            )
+            if fits(line):
+                lines.append(line)
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import get_engine, init_database
+
+    if sys.argv[1:] == ["backfill"]:
+        init_database()
+        with get_engine().begin() as connection:
+            backfill_daily_summaries(connection, rebuild=True)
+        print("✅ 每日摘要已重建")
+    elif sys.argv[1:] == ["show"]:
+        context = build_prompt_context()
+        print(context or "（暂无记录）")
+        print(f"-- 约 {estimate_tokens(context)} token，预算 {CONTEXT_TOKEN_BUDGET}")
+    else:
+        sys.exit("用法：python ai_context.py backfill|show")
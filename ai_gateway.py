@@ -1,14 +1,68 @@
 """AI 网关：为未来接入不同大模型提供统一接口。"""
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Optional
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Generator, Iterator, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func
 
+from database import AIResponseCache, get_read_session, unit_of_work
 
-@dataclass
+SYSTEM_PROMPT = (
+    "你是情侣协作任务助手。请基于输入输出："
+    "1) 今日优先级任务清单（不超过5条）；"
+    "2) 健康提醒建议（2条）；"
+    "3) 赛事/约会安排建议（2条）；"
+    "4) 可执行的最小下一步。"
+)
+CONTEXT_PREFIX = "以下是两人最近的情况摘要，仅供参考："
+TEMPERATURE = 0.7
+NOT_CONFIGURED_MESSAGE = (
+    "AI 未配置。请设置环境变量：CRUSHCOURT_AI_PROVIDER / CRUSHCOURT_AI_BASE_URL / "
+    "CRUSHCOURT_AI_API_KEY / CRUSHCOURT_AI_MODEL。"
+)
+
+# (连接超时, 读取超时) 秒
+REQUEST_TIMEOUT = (5, 30)
+# 失败后最多重试次数，退避为 [0, BACKOFF_BASE * 2^n] 内的随机值（full jitter），单次不超过 BACKOFF_MAX
+MAX_RETRIES = 2
+# 一次 post_with_retries（含重试和退避）最多占用的秒数；读取超时不重试（服务商可能仍在生成）
+REQUEST_DEADLINE = 40
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 同时发往服务商的请求上限，以及排队等待的最长秒数
+MAX_CONCURRENT_CALLS = int(os.getenv("CRUSHCOURT_AI_MAX_CONCURRENCY", "2"))
+SLOT_TIMEOUT = 30
+# 相同请求的跟随者等待领头请求完成的最长秒数
+INFLIGHT_WAIT_TIMEOUT = 120
+# 熔断：连续失败多少次后打开，打开多少秒后放行一次试探请求
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 60
+FALLBACK_MESSAGE = "AI 服务暂时不可用（请求连续失败，已暂停调用），请稍后再试。"
+
+# 回复缓存：过期秒数、最多保留的条数
+CACHE_TTL = int(os.getenv("CRUSHCOURT_AI_CACHE_TTL", str(24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("CRUSHCOURT_AI_CACHE_MAX", "500"))
+# 命中计数和 last_used_at 先记在内存里，最多攒这么多秒，或随下一次写缓存一起写回
+CACHE_TOUCH_FLUSH_SECONDS = 60
+
+
+@dataclass(frozen=True)
 class AIConfig:
     provider: str
     base_url: str
@@ -32,40 +86,442 @@ def load_ai_config() -> Optional[AIConfig]:
     return AIConfig(provider=provider, base_url=base_url.rstrip("/"), api_key=api_key, model=model)
 
 
-def generate_task_suggestion(user_input: str) -> str:
-    """生成任务建议。支持 OpenAI-compatible 接口（DeepSeek/Kimi 开放平台等）。"""
-    config = load_ai_config()
-    if config is None:
-        return (
-            "AI 未配置。请设置环境变量：CRUSHCOURT_AI_PROVIDER / CRUSHCOURT_AI_BASE_URL / "
-            "CRUSHCOURT_AI_API_KEY / CRUSHCOURT_AI_MODEL。"
+@lru_cache(maxsize=1)
+def get_ai_config() -> Optional[AIConfig]:
+    """进程内缓存的 AI 配置；修改环境变量后调用 reload_ai_config()。"""
+    return load_ai_config()
+
+
+def reload_ai_config() -> Optional[AIConfig]:
+    get_ai_config.cache_clear()
+    return get_ai_config()
+
+
+_sessions: dict = {}
+_sessions_lock = threading.Lock()
+
+
+def get_http_session(config: AIConfig) -> requests.Session:
+    """每个服务商一个长连接池，复用 TCP/TLS 连接。"""
+    key = (config.provider, config.base_url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(
+                    {
+                        "Authorization": f"Bearer {config.api_key}",
+                        "Content-Type": "application/json",
+                    }
+                )
+                _sessions[key] = session
+    return session
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器打开，不调用服务商直接失败。"""
+
+
+class ProviderBusyError(RuntimeError):
+    """等待并发名额超时。"""
+
+
+class IncompleteReplyError(RuntimeError):
+    """流式回复没收到 [DONE] 就断开，内容可能不完整。"""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开；打开 reset_timeout 秒后放行一次试探，成功则关闭，失败则重新计时。"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # closed / open / half_open
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # 试探期：放行这一个请求，其余请求要再等一个 reset_timeout
+            self.state = "half_open"
+            self._opened_at = time.monotonic()
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class SingleFlight:
+    """相同 key 的并发调用只真正执行一次，其余调用等待并共享结果。"""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """返回 (future, 是否由本调用执行)。"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def finish(self, key, future, result=None, error=None) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, fn):
+        future, leader = self.begin(key)
+        if not leader:
+            _count("coalesced")
+            return future.result(timeout=INFLIGHT_WAIT_TIMEOUT)
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+
+# 进程内调用统计（cache_hit / cache_miss / provider_call / coalesced / fallback），供压测和排查使用
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        stats[name] += 1
+
+
+_provider_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CALLS)
+_breakers: dict = {}
+_inflight = SingleFlight()
+
+
+def get_circuit_breaker(config: AIConfig) -> CircuitBreaker:
+    with _sessions_lock:
+        return _breakers.setdefault((config.provider, config.base_url), CircuitBreaker())
+
+
+def _is_provider_failure(error: Exception) -> bool:
+    """请求本身有问题（4xx，429 除外）不算服务商故障，不计入熔断。"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return True
+
+
+@contextmanager
+def provider_call(config: AIConfig):
+    """一次服务商调用：先过熔断器，再占一个并发名额，按结果更新熔断器。"""
+    breaker = get_circuit_breaker(config)
+    if not breaker.allow_request():
+        raise CircuitOpenError(FALLBACK_MESSAGE)
+    if not _provider_slots.acquire(timeout=SLOT_TIMEOUT):
+        raise ProviderBusyError("AI 请求排队超时，请稍后再试。")
+    _count("provider_call")
+    try:
+        yield
+    except Exception as e:
+        if _is_provider_failure(e):
+            breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        _provider_slots.release()
+
+
+def fallback_answer(key: str) -> str:
+    """熔断期间的回答：有旧缓存（即使已过期）就用旧的，否则给出提示。"""
+    _count("fallback")
+    cached = cache_get(key, ttl=None)
+    return cached if cached is not None else FALLBACK_MESSAGE
+
+
+def _backoff_delay(attempt: int, response=None) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def post_with_retries(config: AIConfig, path: str, payload: dict, **kwargs) -> requests.Response:
+    """POST 到服务商，连接错误和 429/5xx 按退避重试，其他错误（包括读取超时）直接抛出。
+
+    所有尝试加起来不超过 REQUEST_DEADLINE 秒：每次的读取超时不超过剩余时间，退避后会超时就不再重试。
+    """
+    session = get_http_session(config)
+    url = f"{config.base_url}{path}"
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    connect_timeout, read_timeout = REQUEST_TIMEOUT
+    for attempt in range(MAX_RETRIES + 1):
+        timeout = (connect_timeout, max(min(read_timeout, deadline - time.monotonic()), 1))
+        try:
+            response = session.post(url, json=payload, timeout=timeout, **kwargs)
+        except requests.ReadTimeout:
+            raise
+        except (requests.ConnectionError, requests.Timeout):
+            delay = _backoff_delay(attempt)
+            if attempt == MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+            continue
+
+        if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+            delay = _backoff_delay(attempt, response)
+            if time.monotonic() + delay < deadline:
+                response.close()
+                time.sleep(delay)
+                continue
+        response.raise_for_status()
+        return response
+
+
+def cache_key(model: str, system_prompt: str, user_input: str, temperature: float, context: str = "") -> str:
+    parts = [model, system_prompt, user_input, temperature]
+    if context:
+        parts.append(context)
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_get(key: str, ttl: Optional[int] = CACHE_TTL) -> Optional[str]:
+    """读取缓存的回复；ttl=None 时忽略过期时间。命中只在内存里记一笔，不每次都写库。"""
+    session = get_read_session()
+    try:
+        entry = session.get(AIResponseCache, key)
+    finally:
+        session.close()
+    if entry is None or (ttl is not None and entry.created_at < datetime.now() - timedelta(seconds=ttl)):
+        return None
+
+    if _touch(key):
+        try:
+            with unit_of_work() as session:
+                _flush_touches(session)
+        except Exception as e:
+            print(f"AI 缓存更新失败：{e}")
+    return entry.response
+
+
+_touches: dict = {}  # key -> (未写回的命中次数, 最近一次命中时间)
+_touches_since: Optional[float] = None
+_touches_lock = threading.Lock()
+
+
+def _touch(key: str) -> bool:
+    """记一次命中；最早一笔未写回的命中已超过 CACHE_TOUCH_FLUSH_SECONDS 秒时返回 True。"""
+    global _touches_since
+    with _touches_lock:
+        hits, _ = _touches.get(key, (0, None))
+        _touches[key] = (hits + 1, datetime.now())
+        if _touches_since is None:
+            _touches_since = time.monotonic()
+        return time.monotonic() - _touches_since >= CACHE_TOUCH_FLUSH_SECONDS
+
+
+def _flush_touches(session) -> None:
+    """在给定会话中写回攒下的命中（只是统计和淘汰依据，写回失败就丢掉），不提交。"""
+    global _touches_since
+    with _touches_lock:
+        pending = dict(_touches)
+        _touches.clear()
+        _touches_since = None
+    for key, (hits, last_used_at) in pending.items():
+        session.query(AIResponseCache).filter(AIResponseCache.key == key).update(
+            {
+                AIResponseCache.last_used_at: func.max(AIResponseCache.last_used_at, last_used_at),
+                AIResponseCache.hits: AIResponseCache.hits + hits,
+            }
         )
 
+
+def cache_put(key: str, model: str, response: str) -> None:
+    """写入缓存，并清理过期和超出容量（按 last_used_at 最旧）的条目。"""
+    now = datetime.now()
+    try:
+        with unit_of_work() as session:
+            session.merge(
+                AIResponseCache(key=key, model=model, response=response, created_at=now, last_used_at=now, hits=0)
+            )
+            # 淘汰按 last_used_at 排序，先把内存里的命中写回
+            _flush_touches(session)
+            session.query(AIResponseCache).filter(
+                AIResponseCache.created_at < now - timedelta(seconds=CACHE_TTL)
+            ).delete(synchronize_session=False)
+            overflow = (
+                session.query(AIResponseCache.key)
+                .order_by(AIResponseCache.last_used_at.desc())
+                .offset(CACHE_MAX_ENTRIES)
+                .subquery()
+            )
+            session.query(AIResponseCache).filter(AIResponseCache.key.in_(overflow.select())).delete(
+                synchronize_session=False
+            )
+    except Exception as e:
+        print(f"AI 缓存写入失败：{e}")
+
+
+def build_payload(config: AIConfig, user_input: str, context: str = "") -> dict:
     # 当前统一走 OpenAI-compatible chat completions，便于接入 DeepSeek/Kimi 等平台
-    url = f"{config.base_url}/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {config.api_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": config.model,
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "你是情侣协作任务助手。请基于输入输出："
-                    "1) 今日优先级任务清单（不超过5条）；"
-                    "2) 健康提醒建议（2条）；"
-                    "3) 赛事/约会安排建议（2条）；"
-                    "4) 可执行的最小下一步。"
-                ),
-            },
-            {"role": "user", "content": user_input},
-        ],
-        "temperature": 0.7,
-    }
-
-    response = requests.post(url, headers=headers, json=payload, timeout=30)
-    response.raise_for_status()
-    data = response.json()
-    return data["choices"][0]["message"]["content"].strip()
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system", "content": f"{CONTEXT_PREFIX}\n{context}"})
+    messages.append({"role": "user", "content": user_input})
+    return {"model": config.model, "messages": messages, "temperature": TEMPERATURE}
+
+
+def iter_sse_deltas(response: requests.Response) -> Generator[str, None, bool]:
+    """解析 OpenAI-compatible 的 SSE 流（data: {...} ... data: [DONE]），逐段产出增量文本。
+
+    收到 [DONE] 时生成器返回 True；连接提前断开（回复可能不完整）时返回 False。
+    """
+    # text/event-stream 通常不带 charset，requests 会按 ISO-8859-1 解码，这里强制 UTF-8
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return True
+        choices = json.loads(data).get("choices") or [{}]
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+    return False
+
+
+def _stream_from_provider(config: AIConfig, key: str, user_input: str, context: str = "") -> Generator[str, None, tuple]:
+    """逐段产出回复，结束时返回 (完整内容, 是否收到 [DONE])。"""
+    payload = {**build_payload(config, user_input, context), "stream": True}
+    parts = []
+    with provider_call(config):
+        response = post_with_retries(config, "/chat/completions", payload, stream=True)
+        try:
+            deltas = iter_sse_deltas(response)
+            while True:
+                try:
+                    delta = next(deltas)
+                except StopIteration as stop:
+                    done = stop.value
+                    break
+                parts.append(delta)
+                yield delta
+        finally:
+            response.close()
+
+    content = "".join(parts).strip()
+    # 没收到 [DONE] 的回复可能被截断，只给这一次用，不写缓存
+    if content and done:
+        cache_put(key, config.model, content)
+    return content, done
+
+
+def stream_task_suggestion(user_input: str, context: str = "") -> Iterator[str]:
+    """流式生成任务建议：逐段产出模型返回的文本，收到结束标记 [DONE] 后写入回复缓存。
+
+    context 为附加的近期情况（见 ai_context.build_prompt_context），会一并计入缓存键。
+
+    缓存命中时一次性产出缓存内容；调用方提前停止迭代时不写缓存。
+    相同请求正在生成时不重复调用，等它结束后一次性产出同样的结果；它的回复被截断时自己重新请求。
+    熔断期间返回旧缓存或提示。
+    """
+    config = get_ai_config()
+    if config is None:
+        yield NOT_CONFIGURED_MESSAGE
+        return
+
+    key = cache_key(config.model, SYSTEM_PROMPT, user_input, TEMPERATURE, context)
+    cached = cache_get(key)
+    _count("cache_miss" if cached is None else "cache_hit")
+    if cached is not None:
+        yield cached
+        return
+
+    future, leader = _inflight.begin(key)
+    if not leader:
+        _count("coalesced")
+        try:
+            reply = future.result(timeout=INFLIGHT_WAIT_TIMEOUT)
+        except CircuitOpenError:
+            yield fallback_answer(key)
+        except IncompleteReplyError:
+            yield from stream_task_suggestion(user_input, context)
+        else:
+            yield reply
+        return
+
+    try:
+        content, done = yield from _stream_from_provider(config, key, user_input, context)
+    except CircuitOpenError as e:
+        _inflight.finish(key, future, error=e)
+        yield fallback_answer(key)
+        return
+    except BaseException as e:
+        # 包括调用方提前停止迭代（GeneratorExit），等待中的相同请求也要收到结果
+        _inflight.finish(key, future, error=e if isinstance(e, Exception) else RuntimeError("AI 回复生成被中断"))
+        raise
+    if done:
+        _inflight.finish(key, future, content)
+    else:
+        # 截断的内容只给这一次的调用方，等待中的相同请求各自重试
+        _inflight.finish(key, future, error=IncompleteReplyError("AI 回复不完整"))
+
+
+def _complete(config: AIConfig, key: str, user_input: str, context: str = "") -> str:
+    with provider_call(config):
+        response = post_with_retries(config, "/chat/completions", build_payload(config, user_input, context))
+        data = response.json()
+        content = data["choices"][0]["message"]["content"].strip()
+    cache_put(key, config.model, content)
+    return content
+
+
+def generate_task_suggestion(user_input: str, context: str = "") -> str:
+    """生成任务建议。支持 OpenAI-compatible 接口（DeepSeek/Kimi 开放平台等）。
+
+    context 为附加的近期情况（见 ai_context.build_prompt_context），会一并计入缓存键。
+
+    相同请求并发时只调用一次服务商；熔断期间直接返回旧缓存或提示，不等超时。
+    """
+    config = get_ai_config()
+    if config is None:
+        return NOT_CONFIGURED_MESSAGE
+
+    key = cache_key(config.model, SYSTEM_PROMPT, user_input, TEMPERATURE, context)
+    cached = cache_get(key)
+    _count("cache_miss" if cached is None else "cache_hit")
+    if cached is not None:
+        return cached
+
+    try:
+        return _inflight.do(key, lambda: _complete(config, key, user_input, context))
+    except CircuitOpenError:
+        return fallback_answer(key)
@@ -0,0 +1,250 @@
+"""
+冷热分层归档 - love_records 和 points_log 只增不减，把早于保留期的行移到单独的归档库，主库保持小
+
+归档：python archive.py run [--days N]（默认 CRUSHCOURT_ARCHIVE_DAYS=180 天，适合每天用 cron 跑一次）。
+按 id 分批：先把一批写进归档库并提交，再在主库的一个短写事务里删除这批、推进归档水位。
+中途退出时同一行可能两边都有，读取时按 id 去重，下次运行用 INSERT OR IGNORE 接着搬。
+未回应的记录留在主库（待回应区要用），每张表 id 最大的一行也留下，避免 SQLite 复用 id。
+归档库里的回球记录有自己的全文索引（见 search_index.py），归档后照样能搜到。
+搬完后用 PRAGMA incremental_vacuum 分步把空闲页还给文件系统，不做一次锁全库的 VACUUM
+（旧数据库第一次运行时需要一次完整 VACUUM 切换到增量模式）。
+
+读取：历史查询先查主库；查询起点早于归档水位、且主库的结果不够时才再查归档库并合并，
+最近几天、30 天的页面照常只读主库。积分、情绪和每日汇总表不归档，仍然覆盖全部历史；
+重建这些汇总表（迁移、导入）和导出时会把归档库的行一起算上（database.iter_archived）。
+查看：python archive.py status
+"""
+import argparse
+import os
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.sqlite import insert
+
+from database import (
+    ARCHIVE_PATH,
+    DB_PATH,
+    ArchiveWatermark,
+    Base,
+    LoveRecord,
+    PointsLog,
+    bump_table_versions,
+    get_archive_engine,
+    get_archive_read_engine,
+    get_archive_read_session,
+    get_engine,
+    get_read_engine,
+    get_read_session,
+    init_database,
+)
+from query_cache import cached_query
+from search_index import ensure_search_index
+
+ARCHIVE_DAYS = int(os.getenv("CRUSHCOURT_ARCHIVE_DAYS", "180"))
+BATCH_ROWS = 2000  # 每批搬运的行数，主库写锁每次只占用删除这一批的时间
+VACUUM_STEP_PAGES = 1000  # 每次 incremental_vacuum 归还的页数
+
+# 归档的表，以及除了“早于保留期”之外还要满足的条件
+ARCHIVED = {
+    LoveRecord: LoveRecord.is_responded == True,  # noqa: E712
+    PointsLog: None,
+}
+
+
+@cached_query("archive_watermarks")
+def archived_before(name):
+    """该表的归档水位；从没归档过为 None。"""
+    session = get_read_session()
+    try:
+        watermark = session.get(ArchiveWatermark, name)
+        return watermark.archived_before if watermark else None
+    finally:
+        session.close()
+
+
+def with_archived(name, since, hot_rows, load_archived, key, limit=None):
+    """合并热库和归档库的历史查询结果。
+
+    hot_rows 是主库按 key 倒序取出的最多 limit 行，key(row) 返回 (created_at, id)；since=None 表示不限起点。
+    查询起点不早于归档水位，或者主库已经取满 limit 行且最旧一行也不早于水位时，直接返回 hot_rows；
+    否则调用 load_archived(归档库只读会话) 取归档行，按 id 去重（主库优先）后倒序合并。
+    """
+    watermark = archived_before(name)
+    if watermark is None or (since is not None and since >= watermark):
+        return hot_rows
+    if limit is not None and len(hot_rows) >= limit and key(hot_rows[-1])[0] >= watermark:
+        return hot_rows
+
+    session = get_archive_read_session()
+    try:
+        cold_rows = load_archived(session)
+    finally:
+        session.close()
+
+    hot_ids = {key(row)[1] for row in hot_rows}
+    rows = list(hot_rows) + [row for row in cold_rows if key(row)[1] not in hot_ids]
+    rows.sort(key=key, reverse=True)
+    return rows[:limit] if limit is not None else rows
+
+
+def _archive_conditions(table, extra, cutoff):
+    conditions = [
+        table.c.created_at < cutoff,
+        table.c.id < select(func.max(table.c.id)).scalar_subquery(),
+    ]
+    if extra is not None:
+        conditions.append(extra)
+    return conditions
+
+
+def _advance_watermark(connection, name, cutoff, moved):
+    stmt = insert(ArchiveWatermark).values(
+        name=name, archived_before=cutoff, archived_rows=moved, updated_at=datetime.now()
+    )
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ArchiveWatermark.name],
+            set_={
+                "archived_before": func.max(ArchiveWatermark.archived_before, stmt.excluded.archived_before),
+                "archived_rows": ArchiveWatermark.archived_rows + stmt.excluded.archived_rows,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+    )
+
+
+def archive_table(model, cutoff, batch_rows=BATCH_ROWS):
+    """把一张表早于 cutoff 的行分批移到归档库，返回移动的行数。"""
+    table = model.__table__
+    conditions = _archive_conditions(table, ARCHIVED[model], cutoff)
+    moved = 0
+    while True:
+        with get_read_engine().connect() as connection:
+            rows = connection.execute(
+                select(table).where(*conditions).order_by(table.c.id).limit(batch_rows)
+            ).mappings().all()
+        if not rows:
+            return moved
+
+        # 先让归档库提交，再删主库：任何时候中断都不会丢数据
+        with get_archive_engine().begin() as connection:
+            connection.execute(table.insert().prefix_with("OR IGNORE"), [dict(row) for row in rows])
+        ids = [row["id"] for row in rows]
+        with get_engine().begin() as connection:
+            connection.execute(delete(table).where(table.c.id.in_(ids)))
+            _advance_watermark(connection, table.name, cutoff, len(ids))
+            bump_table_versions(connection, [table.name, ArchiveWatermark.__tablename__])
+        moved += len(ids)
+
+
+def clear_archived(connection, tables):
+    """清空归档库里这些表的行，并在 connection（主库写事务）里删除它们的归档水位，导入 --replace 时调用。
+
+    归档库先提交，水位随主库事务提交；主库事务之后失败时这些表只是少了归档的旧行，旧行不会再混进查询和汇总。
+    """
+    names = [table.name for table in tables if table.name in {model.__tablename__ for model in ARCHIVED}]
+    if not names:
+        return
+    if ARCHIVE_PATH.exists():
+        with get_archive_engine().begin() as archive:
+            existing = set(archive.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+            for table in tables:
+                if table.name in names and table.name in existing:
+                    archive.execute(delete(table))  # 全文索引由触发器同步
+    connection.execute(delete(ArchiveWatermark).where(ArchiveWatermark.name.in_(names)))
+    bump_table_versions(connection, [ArchiveWatermark.__tablename__])
+
+
+def incremental_vacuum(engine, step_pages=VACUUM_STEP_PAGES):
+    """分步归还空闲页，每步是一个单独的短写事务；返回归还的页数。"""
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # 旧数据库不是增量模式：完整 VACUUM 一次切换过去，之后就不用再做
+            print("  首次切换到增量 VACUUM 模式，执行一次完整 VACUUM…")
+            free = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+            return free
+        start = free = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        while free:
+            # execute 只会执行一步（归还一页），executescript 才会把这一条 PRAGMA 执行完
+            cursor.executescript(f"PRAGMA incremental_vacuum({min(free, step_pages)})")
+            free = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        freed = start - free
+        # WAL 模式下文件要在 checkpoint 之后才真正变小
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return freed
+    finally:
+        raw.close()
+
+
+def _file_mib(path):
+    return path.stat().st_size / 1024 / 1024 if path.exists() else 0.0
+
+
+def run_archive(days=ARCHIVE_DAYS, batch_rows=BATCH_ROWS):
+    """归档早于 days 天前（按本地日期对齐）的行，然后增量 VACUUM 主库；返回 {表名: 行数}。"""
+    if days < 1:
+        raise ValueError("保留天数至少为 1")
+    init_database()
+    archive_engine = get_archive_engine()
+    Base.metadata.create_all(archive_engine, tables=[model.__table__ for model in ARCHIVED])
+    # 归档的回球记录仍然可以搜索：归档库有自己的全文索引，由触发器在搬入时建立
+    with archive_engine.begin() as connection:
+        ensure_search_index(connection)
+    cutoff = datetime.combine(date.today() - timedelta(days=days), time.min)
+    size_before = _file_mib(DB_PATH)
+
+    print(f"🗄️ 归档 {cutoff:%Y-%m-%d} 之前的记录到 {ARCHIVE_PATH}")
+    counts = {}
+    for model in ARCHIVED:
+        counts[model.__tablename__] = archive_table(model, cutoff, batch_rows)
+        print(f"  {model.__tablename__:<14} 移走 {counts[model.__tablename__]} 行")
+
+    freed = incremental_vacuum(get_engine()) if any(counts.values()) else 0
+    print(f"  主库 {size_before:.1f} MiB → {_file_mib(DB_PATH):.1f} MiB（归还 {freed} 页）")
+    return counts
+
+
+def archive_status():
+    """各表在主库和归档库的行数，以及归档水位。"""
+    init_database()
+    status = {}
+    with get_read_engine().connect() as connection:
+        for model in ARCHIVED:
+            name = model.__tablename__
+            status[name] = {
+                "hot": connection.execute(select(func.count()).select_from(model.__table__)).scalar(),
+                "archived": 0,
+                "archived_before": archived_before.uncached(name),
+            }
+    if ARCHIVE_PATH.exists():
+        with get_archive_read_engine().connect() as connection:
+            for name, item in status.items():
+                item["archived"] = connection.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷热分层归档")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="归档早于保留期的记录并增量 VACUUM")
+    run_parser.add_argument("--days", type=int, default=ARCHIVE_DAYS, help="主库保留的天数")
+    run_parser.add_argument("--batch", type=int, default=BATCH_ROWS, help="每批搬运的行数")
+    commands.add_parser("status", help="查看主库/归档库行数和归档水位")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_archive(args.days, args.batch)
+    else:
+        for name, item in archive_status().items():
+            watermark = item["archived_before"]
+            note = f"水位 {watermark:%Y-%m-%d}" if watermark else "未归档"
+            print(f"  {name:<14} 主库 {item['hot']:>8} 行  归档库 {item['archived']:>8} 行  {note}")
+        print(f"  主库 {_file_mib(DB_PATH):.1f} MiB，归档库 {_file_mib(ARCHIVE_PATH):.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
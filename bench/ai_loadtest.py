@@ -0,0 +1,145 @@
+"""
+ai_gateway 压测 - 多个并发调用方反复调用 generate_task_suggestion（或流式接口）
+
+默认在进程内启动 bench/ai_stub_server.py 的桩服务，数据库放在临时目录，完全不联网。
+输出延迟 p50/p95/p99、吞吐、缓存命中率，以及实际打到服务商的请求数。
+
+用法：
+    python bench/ai_loadtest.py --callers 8 --requests 200 --prompts 20
+    python bench/ai_loadtest.py --stream --error-rate 0.1
+    python bench/ai_loadtest.py --base-url http://127.0.0.1:8765   # 使用已启动的桩服务
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from ai_stub_server import StubConfig, start_stub_server  # noqa: E402
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[p - 1]
+
+
+def run(args):
+    server = stub_stats = None
+    base_url = args.base_url
+    if not base_url:
+        server, stub_stats = start_stub_server(
+            StubConfig(
+                latency_ms=args.latency_ms,
+                error_rate=args.error_rate,
+                tokens_per_sec=args.tokens_per_sec,
+            )
+        )
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    # 必须在导入 database / ai_gateway 之前设置
+    data_dir = None
+    if not os.getenv("CRUSHCOURT_DATA_DIR"):
+        data_dir = tempfile.mkdtemp(prefix="crushcourt-bench-")
+        os.environ["CRUSHCOURT_DATA_DIR"] = data_dir
+    os.environ.update(
+        {
+            "CRUSHCOURT_AI_PROVIDER": "stub",
+            "CRUSHCOURT_AI_BASE_URL": base_url,
+            "CRUSHCOURT_AI_API_KEY": "bench",
+            "CRUSHCOURT_AI_MODEL": "stub-model",
+        }
+    )
+
+    import ai_gateway
+    from database import init_database
+
+    init_database()
+
+    prompts = [f"压测需求 #{i}：这周要准备比赛、控制饮食、还要安排一次约会" for i in range(args.prompts)]
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def caller():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            prompt = prompts[i % len(prompts)]
+            start = time.perf_counter()
+            try:
+                if args.stream:
+                    "".join(ai_gateway.stream_task_suggestion(prompt))
+                else:
+                    ai_gateway.generate_task_suggestion(prompt)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=caller) for _ in range(args.callers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    stats = ai_gateway.stats
+    lookups = stats["cache_hit"] + stats["cache_miss"]
+    print(f"模式：{'流式' if args.stream else '普通'} · 并发 {args.callers} · 请求 {args.requests} · 不同提示 {args.prompts}")
+    print(f"成功 {len(latencies)} · 失败 {len(errors)}" + (f"（{', '.join(sorted(set(errors)))}）" if errors else ""))
+    print(
+        "延迟 ms："
+        f"p50 {percentile(latencies, 50) * 1000:.1f} · "
+        f"p95 {percentile(latencies, 95) * 1000:.1f} · "
+        f"p99 {percentile(latencies, 99) * 1000:.1f} · "
+        f"max {(latencies[-1] if latencies else 0) * 1000:.1f}"
+    )
+    print(f"吞吐：{len(latencies) / wall:.1f} 请求/秒（总耗时 {wall:.2f}s）")
+    print(
+        f"缓存命中率：{stats['cache_hit'] / lookups:.1%}" if lookups else "缓存命中率：-",
+        f"· 合并的并发请求 {stats['coalesced']} · 熔断兜底 {stats['fallback']}",
+    )
+    print(f"服务商调用：{stats['provider_call']}" + (f" · 桩服务收到 {stub_stats.as_dict()}" if stub_stats else ""))
+
+    if server is not None:
+        server.shutdown()
+    if data_dir is not None:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 1 if errors and not args.allow_errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ai_gateway 离线压测")
+    parser.add_argument("--callers", type=int, default=8, help="并发调用方数量")
+    parser.add_argument("--requests", type=int, default=200, help="总请求数")
+    parser.add_argument("--prompts", type=int, default=20, help="不同提示的数量（越少缓存命中越多）")
+    parser.add_argument("--stream", action="store_true", help="压测流式接口")
+    parser.add_argument("--base-url", help="使用已启动的服务，不在进程内启动桩服务")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--allow-errors", action="store_true", help="有失败请求时仍以 0 退出")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+本地 OpenAI-compatible 桩服务 - 不联网压测 ai_gateway
+
+支持 POST /chat/completions（普通和 stream: true 两种），可以配置延迟、错误率和出字速度；
+GET /stats 返回收到的请求数。
+
+用法：python bench/ai_stub_server.py --port 8765 --latency-ms 300 --error-rate 0.05 --tokens-per-sec 50
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 300.0  # 首包前的平均延迟
+    jitter_ms: float = 50.0  # 延迟的随机抖动（±）
+    error_rate: float = 0.0  # 返回 503/429 的概率
+    tokens_per_sec: float = 50.0  # 流式出字速度，0 表示不限速
+    reply_tokens: int = 40  # 每次回复的 token（片段）数
+
+
+class StubStats:
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {"requests": self.requests, "streams": self.streams, "errors": self.errors}
+
+
+def _reply_tokens(prompt, count):
+    return [f"第{i + 1}步：处理「{prompt[:8]}」。" if i % 8 == 0 else "好的" for i in range(count)]
+
+
+def make_handler(config: StubConfig, stats: StubStats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send_json(200, stats.as_dict())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": "not found"})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            stats.add("requests")
+
+            delay = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+            time.sleep(delay)
+
+            if random.random() < config.error_rate:
+                stats.add("errors")
+                status = random.choice([429, 503])
+                self.send_response(status)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            messages = body.get("messages") or [{}]
+            tokens = _reply_tokens(messages[-1].get("content", ""), config.reply_tokens)
+            if body.get("stream"):
+                stats.add("streams")
+                self._stream(body, tokens)
+            else:
+                self._send_json(
+                    200,
+                    {
+                        "object": "chat.completion",
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    },
+                )
+
+        def _stream(self, body, tokens):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            interval = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0
+            for token in tokens:
+                chunk = {
+                    "object": "chat.completion.chunk",
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": token}}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if interval:
+                    time.sleep(interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_stub_server(config: StubConfig = None, host="127.0.0.1", port=0):
+    """在后台线程启动桩服务，返回 (server, stats)；server.server_port 为实际端口。"""
+    stats = StubStats()
+    server = ThreadingHTTPServer((host, port), make_handler(config or StubConfig(), stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ai-stub", daemon=True).start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI-compatible 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=StubConfig.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--tokens-per-sec", type=float, default=StubConfig.tokens_per_sec)
+    parser.add_argument("--reply-tokens", type=int, default=StubConfig.reply_tokens)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_tokens=args.reply_tokens,
+    )
+    server, _ = start_stub_server(config, args.host, args.port)
+    print(f"🤖 桩服务已启动：http://{args.host}:{server.server_port}（Ctrl+C 退出）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+冷启动导入耗时 - 用 python -X importtime 比较登录页按需导入和启动即导入全部页面的差别
+
+每个场景在新的子进程里导入一组模块，重复若干次取中位数，并列出最重的几个顶层依赖。
+
+用法：
+    python bench/importtime.py
+    python bench/importtime.py --repeat 9 --top 5
+    python bench/importtime.py --modules streamlit,database,court   # 自定义场景
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# 登录页（库已是最新版本时）streamlit_app 导入的模块；services、outbox、scheduler 登录后才导入
+LOGIN = ["streamlit", "database", "migrations", "change_feed"]
+
+# 场景名 -> 该场景下 streamlit_app 实际会导入的模块
+SCENARIOS = {
+    "登录页（按需导入）": LOGIN,
+    "启动即导入全部页面（旧）": ["streamlit", "database", "court", "health", "points", "tasks"],
+    "首次打开双人球场": [*LOGIN, "services", "court"],
+    "首次打开健康管理": [*LOGIN, "services", "health"],
+    "首次打开赛事任务": [*LOGIN, "services", "tasks"],
+    "首次打开积分奖赏": [*LOGIN, "services", "points"],
+}
+
+
+def parse_importtime(stderr: str) -> dict:
+    """解析 -X importtime 的输出，返回 {顶层模块: 累计微秒}。"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|", 2)
+        # 顶层导入的模块名前只有一个空格，被它间接导入的再缩进两格
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        totals[name.strip()] = int(cumulative)
+    return totals
+
+
+def measure(modules, env) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def run(scenarios, repeat, top):
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    # 先导入一次生成 .pyc，之后的测量才是稳定的“冷进程、热磁盘”
+    measure(sorted({m for modules in scenarios.values() for m in modules}), env)
+
+    medians = {}
+    for name, modules in scenarios.items():
+        runs = [measure(modules, env) for _ in range(repeat)]
+        medians[name] = statistics.median(sum(r.values()) for r in runs) / 1000
+        heaviest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)[:top]
+        detail = "、".join(f"{module} {us / 1000:.0f}" for module, us in heaviest)
+        print(f"{name:<24} {medians[name]:8.1f} ms   （{detail}）")
+
+    lazy, eager = "登录页（按需导入）", "启动即导入全部页面（旧）"
+    if lazy in medians and eager in medians:
+        saved = medians[eager] - medians[lazy]
+        print(f"\n登录页冷启动少导入 {saved:.1f} ms（{saved / medians[eager]:.0%}）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较各页面的冷启动导入耗时")
+    parser.add_argument("--repeat", type=int, default=5, help="每个场景重复次数，取中位数")
+    parser.add_argument("--top", type=int, default=3, help="每个场景列出的最重顶层依赖数")
+    parser.add_argument("--modules", help="只测一组逗号分隔的模块")
+    args = parser.parse_args()
+
+    scenarios = {args.modules: args.modules.split(",")} if args.modules else SCENARIOS
+    # 导入 database 不会建库，这里仍然指向临时目录，避免意外写到仓库里
+    with tempfile.TemporaryDirectory(prefix="crushcourt-importtime-") as data_dir:
+        os.environ.setdefault("CRUSHCOURT_DATA_DIR", data_dir)
+        run(scenarios, args.repeat, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+本地 webhook 接收端 - 代替真实推送服务，测试 outbox 的 webhook sink
+
+POST 任意路径：接收 {"messages": [...]}，按消息 id 去重后记下来；可以配置失败率测试重试。
+GET /messages 返回收到的消息，GET /stats 返回请求数、重复数和失败数。
+
+用法：
+    python bench/webhook_sink_server.py --port 8787 --error-rate 0.2
+    CRUSHCOURT_OUTBOX_SINKS=webhook:http://127.0.0.1:8787/hook streamlit run streamlit_app.py
+"""
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = {}  # id -> message
+        self.requests = 0
+        self.duplicates = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, messages):
+        with self._lock:
+            self.requests += 1
+            for message in messages:
+                if message.get("id") in self.messages:
+                    self.duplicates += 1
+                else:
+                    self.messages[message.get("id")] = message
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "messages": len(self.messages),
+                "duplicates": self.duplicates,
+                "errors": self.errors,
+            }
+
+
+def make_handler(inbox: Inbox, error_rate: float, verbose: bool):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/messages":
+                with inbox._lock:
+                    self._send_json(200, sorted(inbox.messages.values(), key=lambda m: m.get("id") or 0))
+            elif self.path.rstrip("/") == "/stats":
+                self._send_json(200, inbox.stats())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if random.random() < error_rate:
+                with inbox._lock:
+                    inbox.errors += 1
+                self._send_json(503, {"error": "injected failure"})
+                return
+            messages = body.get("messages", [])
+            inbox.add(messages)
+            if verbose:
+                for message in messages:
+                    print(f"📨 #{message.get('id')} {message.get('topic')} → {message.get('recipient') or '两人'}")
+            self._send_json(200, {"received": len(messages)})
+
+    return Handler
+
+
+def start_webhook_server(error_rate=0.0, host="127.0.0.1", port=0, verbose=False):
+    """在后台线程启动接收端，返回 (server, inbox)；server.server_port 为实际端口。"""
+    inbox = Inbox()
+    server = ThreadingHTTPServer((host, port), make_handler(inbox, error_rate, verbose))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="webhook-sink", daemon=True).start()
+    return server, inbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 webhook 接收端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, _ = start_webhook_server(args.error_rate, args.host, args.port, verbose=True)
+    print(f"🪝 webhook 接收端已启动：http://{args.host}:{server.server_port}/hook（Ctrl+C 退出）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+图片文件库 - 按内容哈希存放在磁盘上，数据库里只记 64 位十六进制的 sha256
+
+原图：data/blobs/ab/cd/<sha256>，按哈希前两级分目录，同一张图只存一份。
+缩略图：写入原图时按 THUMBNAIL_SIZES 预先生成 data/blobs/thumbs/<边长>/ab/cd/<sha256>.webp，
+画廊只读小缩略图，点开才读大图。内容不变哈希就不变，读取结果可以放心长期缓存。
+缩略图需要 Pillow（streamlit 已依赖）；没装时只存原图，读缩略图时退回原图。
+清理：python blobstore.py gc（删除没有荣誉记录引用、且超过宽限期的文件）
+重建缩略图：python blobstore.py thumbnails
+旧数据：迁移调用 move_inline_photos，把 photo_url 里内嵌的图片搬进来（Pillow 确认是图片才搬）。
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+from database import DATA_DIR
+
+BLOB_DIR = DATA_DIR / "blobs"
+THUMBNAIL_SIZES = (320, 1024)  # 缩略图最长边（像素）：画廊格子、点开后的大图
+THUMBNAIL_QUALITY = 80
+MAX_BLOB_BYTES = 20 * 1024 * 1024
+GC_GRACE_SECONDS = 24 * 3600  # 刚写入、记录还没提交的文件不清理
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+APP_DIR = Path(__file__).resolve().parent  # 旧记录里的相对路径相对于应用目录，而不是当前工作目录
+
+
+def _check_hash(digest: str) -> str:
+    # 哈希直接拼进路径，只接受 sha256 十六进制
+    if not isinstance(digest, str) or not _HASH_RE.match(digest):
+        raise ValueError(f"无效的文件哈希：{digest!r}")
+    return digest
+
+
+def blob_path(digest: str) -> Path:
+    digest = _check_hash(digest)
+    return BLOB_DIR / digest[:2] / digest[2:4] / digest
+
+
+def thumbnail_path(digest: str, size: int) -> Path:
+    digest = _check_hash(digest)
+    return BLOB_DIR / "thumbs" / str(size) / digest[:2] / digest[2:4] / f"{digest}.webp"
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """先写临时文件再改名，读的一方不会看到写了一半的文件。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def make_thumbnails(digest: str, data: bytes = None, sizes=THUMBNAIL_SIZES) -> list:
+    """生成缩略图，返回生成的边长列表；没有 Pillow 或不是图片时返回空列表。"""
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        return []
+    if data is None:
+        data = blob_path(digest).read_bytes()
+    try:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    except (UnidentifiedImageError, OSError):
+        return []
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    made = []
+    for size in sizes:
+        thumb = image.copy()
+        thumb.thumbnail((size, size))
+        buffer = io.BytesIO()
+        thumb.save(buffer, format="WEBP", quality=THUMBNAIL_QUALITY)
+        _write_atomic(thumbnail_path(digest, size), buffer.getvalue())
+        made.append(size)
+    return made
+
+
+def put(data: bytes) -> str:
+    """存入一份内容并生成缩略图，返回 sha256；已存在时直接返回（去重）。"""
+    if not data:
+        raise ValueError("文件内容为空")
+    if len(data) > MAX_BLOB_BYTES:
+        raise ValueError(f"文件超过 {MAX_BLOB_BYTES // 1024 // 1024} MiB")
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if path.exists():
+        os.utime(path)  # 重新上传的旧文件也算“刚写入”，gc 不会在记录提交前删掉它
+    else:
+        _write_atomic(path, data)
+    if not all(thumbnail_path(digest, size).exists() for size in THUMBNAIL_SIZES):
+        make_thumbnails(digest, data)
+    return digest
+
+
+def exists(digest: str) -> bool:
+    return blob_path(digest).exists()
+
+
+def read(digest: str, size: int = None) -> bytes:
+    """读原图，或最长边为 size 的缩略图（没有时退回原图）。"""
+    if size is not None:
+        thumb = thumbnail_path(digest, size)
+        if thumb.exists():
+            return thumb.read_bytes()
+    return blob_path(digest).read_bytes()
+
+
+def _stored_hashes():
+    for path in BLOB_DIR.glob("[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*"):
+        if _HASH_RE.match(path.name):
+            yield path.name, path
+
+
+def referenced_hashes() -> set:
+    from sqlalchemy import text
+
+    from database import get_read_engine
+
+    with get_read_engine().connect() as connection:
+        return {
+            row[0]
+            for row in connection.execute(text("SELECT photo_hash FROM honor_records WHERE photo_hash IS NOT NULL"))
+        }
+
+
+def collect_garbage(grace_seconds=GC_GRACE_SECONDS) -> int:
+    """删除没有被引用、且修改时间早于宽限期的原图和缩略图，返回删除的原图数。"""
+    referenced = referenced_hashes()
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for digest, path in list(_stored_hashes()):
+        if digest in referenced or path.stat().st_mtime > cutoff:
+            continue
+        for size in THUMBNAIL_SIZES:
+            thumbnail_path(digest, size).unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def _is_image(data: bytes) -> bool:
+    """Pillow 能识别的图片才算；没装 Pillow 时无法确认，一律不算。"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        return True
+    except Exception:  # verify 对各种损坏的文件抛出的异常类型不固定
+        return False
+
+
+def _legacy_photo_bytes(value):
+    """旧的 photo_url 里能取到的内容：data URL、base64 或本地路径；网址和取不到的返回 None。"""
+    value = value.strip()
+    if value.startswith(("http://", "https://")):
+        return None
+    if value.startswith("data:"):
+        header, _, payload = value.partition(",")
+        try:
+            return base64.b64decode(payload) if header.endswith(";base64") else None
+        except (binascii.Error, ValueError):
+            return None
+    try:
+        path = Path(value)
+        path = path if path.is_absolute() else APP_DIR / path
+        if path.is_file():
+            return path.read_bytes()
+    except (OSError, ValueError):
+        pass  # 很长的 base64 当路径会报文件名过长
+    try:
+        return base64.b64decode(value, validate=True) or None
+    except (binascii.Error, ValueError):
+        return None
+
+
+def move_inline_photos(connection) -> int:
+    """迁移用：加 photo_hash 列，把 photo_url 里内嵌/本地的图片搬进文件库，返回搬过的条数。
+
+    只有 Pillow 确认是图片的内容才搬（像 "cute" 这样碰巧是合法 base64 的文字不算），
+    其余记录的 photo_url 原样保留，仍按旧地址显示。
+    """
+    from sqlalchemy import text
+
+    from database import bump_table_versions
+
+    columns = {row[1] for row in connection.exec_driver_sql("PRAGMA table_info(honor_records)")}
+    if "photo_hash" not in columns:
+        connection.exec_driver_sql("ALTER TABLE honor_records ADD COLUMN photo_hash VARCHAR(64)")
+
+    ids = connection.execute(
+        text("SELECT id FROM honor_records WHERE photo_url IS NOT NULL AND photo_url != '' AND photo_hash IS NULL")
+    ).scalars().all()
+    moved = 0
+    for honor_id in ids:
+        # 一次只读一条，不把所有内嵌图片同时读进内存
+        value = connection.execute(
+            text("SELECT photo_url FROM honor_records WHERE id = :id"), {"id": honor_id}
+        ).scalar()
+        data = _legacy_photo_bytes(value)
+        if data is None or not _is_image(data):
+            continue
+        try:
+            digest = put(data)
+        except ValueError as e:
+            warnings.warn(f"荣誉记录 {honor_id} 的图片未迁移，保留原地址：{e}", stacklevel=2)
+            continue
+        connection.execute(
+            text("UPDATE honor_records SET photo_hash = :hash, photo_url = NULL WHERE id = :id"),
+            {"hash": digest, "id": honor_id},
+        )
+        moved += 1
+    if moved:
+        bump_table_versions(connection, ["honor_records"])
+    return moved
+
+
+if __name__ == "__main__":
+    from database import init_database
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "gc":
+        init_database()
+        print(f"🧹 已删除 {collect_garbage()} 个未引用的文件")
+    elif command == "thumbnails":
+        count = sum(1 for digest, _ in _stored_hashes() if make_thumbnails(digest))
+        print(f"🖼️ 已为 {count} 张图片重建缩略图（{', '.join(map(str, THUMBNAIL_SIZES))}）")
+    else:
+        sys.exit("用法：python blobstore.py gc | thumbnails")
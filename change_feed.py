@@ -0,0 +1,55 @@
+"""
+变更流 - 用全库递增的变更序号让页面自动看到对方的新动作，不用手动点一下才刷新
+
+每次写事务提交都会给写过的表分配一个新的变更序号（见 database.bump_table_versions）。
+latest_sequence 取几张表的最大序号：没有任何提交时只看一眼 PRAGMA data_version，不查表。
+页面上会变的内容块各自是 live_fragment：定时只重跑自己这一块，整页从不因为变更而重跑，
+所以不会打断别处的按钮、表单和正在流式输出的回答。advanced 用来判断“上次之后有没有新变化”，比如弹提示；
+load_when_changed 让片段在序号没前进时直接复用上次读到的数据，定时重跑只多一次序号比较。
+CRUSHCOURT_LIVE_REFRESH 设置检查间隔秒数（默认 5），设为 0 关闭自动刷新。
+"""
+import os
+
+import streamlit as st
+
+from query_cache import query_cache
+
+# 会出现在对方页面上的表
+FEED_TABLES = ("love_records", "points_log", "health_logs", "match_reminders")
+LIVE_REFRESH_SECONDS = float(os.getenv("CRUSHCOURT_LIVE_REFRESH", "5"))
+
+
+def latest_sequence(tables=FEED_TABLES) -> int:
+    """这些表最近一次被写入时的变更序号，从没写过为 0。"""
+    return max(query_cache.monitor.versions(tables), default=0)
+
+
+def advanced(key: str, tables=FEED_TABLES) -> bool:
+    """本会话上次用同一个 key 调用之后，这些表是否有新的提交；第一次调用返回 False。"""
+    seen = st.session_state.setdefault("change_feed", {})
+    latest = latest_sequence(tables)
+    previous = seen.get(key)
+    seen[key] = latest
+    return previous is not None and latest > previous
+
+
+def live_fragment(fn=None, *, every=None):
+    """像 st.fragment 一样使用；每隔 every 秒（默认 LIVE_REFRESH_SECONDS）自动重跑这一个片段。
+    片段里的数据用 load_when_changed 读取，没有新提交时重跑只是把上次的结果再画一遍。"""
+    interval = LIVE_REFRESH_SECONDS if every is None else every
+
+    def decorator(func):
+        return st.fragment(func, run_every=interval if interval > 0 else None)
+
+    return decorator(fn) if fn is not None else decorator
+
+
+def load_when_changed(key: str, tables, load, *args, **kwargs):
+    """片段每次重跑都调用：这些表没有新提交、参数也没变时直接返回本会话上次 load(*args, **kwargs) 的结果。"""
+    views = st.session_state.setdefault("change_feed_views", {})
+    changed = advanced(key, tables)
+    params = (args, kwargs)
+    view = views.get(key)
+    if changed or view is None or view[0] != params:
+        view = views[key] = (params, load(*args, **kwargs))
+    return view[1]
@@ -6,11 +6,45 @@
 放网：温柔回应
 """
 import streamlit as st
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-from database import get_session, LoveRecord
-from visualizations import create_emotion_timeline
+from datetime import date, datetime, timedelta
+from database import get_read_session, LoveRecord
+from query_cache import cached_query
+from archive import with_archived
+from change_feed import live_fragment, load_when_changed
+import services
+from rollups import get_emotion_heatmap_cells, get_timeline_rollup_frame
+from visualizations import (
+    create_emotion_heatmap,
+    create_emotion_timeline,
+    downsample_timeline,
+    truncate_preview,
+)
 import plotly.graph_objects as go
+from sqlalchemy import String, func, select, tuple_, type_coerce
+from streamlit.errors import StreamlitAPIException
+
+# 待回应区每次加载的条数
+PENDING_PAGE_SIZE = 20
+
+# 时间线查询在 SQL 里截取的内容预览长度（表格显示 20 字，图表悬浮显示 15 字）
+PREVIEW_CHARS = 20
+
+# 时间线可选范围（天）
+TIMELINE_RANGES = {
+    3: '3天',
+    7: '7天',
+    30: '30天',
+    90: '90天',
+    365: '一年',
+}
+# 不超过这个天数时直接读原始记录，更长的范围读小时汇总表
+RAW_TIMELINE_DAYS = 7
+# 原始记录最多读取的条数（之后再降采样到图表点数上限）
+RAW_TIMELINE_LIMIT = 5000
+# 详细记录表格显示的条数
+TIMELINE_TABLE_ROWS = 50
 
 # 记录类型和对应的emoji
 RECORD_TYPES = {
@@ -52,102 +86,315 @@ def get_user_display(user):
     return '💕 我' if user == 'me' else '🏸 他'
 
 def save_love_record(sender, receiver, record_type, action, content, emotion_score=5.0):
-    """保存一条爱情记录"""
-    session = get_session()
+    """保存一条爱情记录（发球积分在同一事务内写入）"""
     try:
-        record = LoveRecord(
-            sender=sender,
-            receiver=receiver,
-            record_type=record_type,
-            action=action,
-            content=content,
-            emotion_score=emotion_score,
-            created_at=datetime.now()
-        )
-        session.add(record)
-        session.commit()
-        
-        # 如果是发球，给对方加积分
-        if action == 'serve':
-            from points import add_points
-            add_points(sender, 5, f'发布新动态：{content[:20]}...')
-        
+        services.run(services.serve_ball, sender, receiver, record_type, action, content, emotion_score)
         return True
     except Exception as e:
         st.error(f"保存失败：{e}")
-        session.rollback()
         return False
+
+@cached_query("love_records")
+def get_timeline_frame(days=3, limit=50):
+    """最近几天记录的列式数据，表格和情绪时间线共用
+
+    只查需要的列，内容预览用 substr 在 SQL 里截断；时间按原始字符串取出，
+    交给 pandas 一次性解析，不逐行构造 ORM 对象和 dict。范围早于归档水位时合并归档库。
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    stmt = select(
+        type_coerce(LoveRecord.created_at, String),
+        LoveRecord.sender,
+        LoveRecord.record_type,
+        LoveRecord.action,
+        LoveRecord.emotion_score,
+        func.substr(LoveRecord.content, 1, PREVIEW_CHARS),
+        func.length(LoveRecord.content),
+        LoveRecord.id,
+    ).where(
+        LoveRecord.created_at >= cutoff
+    ).order_by(
+        LoveRecord.created_at.desc()
+    ).limit(limit)
+    
+    session = get_read_session()
+    try:
+        rows = session.execute(stmt).all()
     finally:
         session.close()
+    rows = with_archived(
+        'love_records', cutoff, rows, lambda s: s.execute(stmt).all(),
+        key=lambda r: (datetime.fromisoformat(r[0]), r[-1]), limit=limit
+    )
+    
+    columns = list(zip(*rows)) if rows else [()] * 8
+    created_at, sender, record_type, action, emotion_score, preview, content_length, _ = columns
+    return pd.DataFrame({
+        'created_at': pd.to_datetime(pd.Series(created_at, dtype=object), format='ISO8601'),
+        'sender': pd.Categorical(sender, categories=['me', 'him']),
+        'record_type': pd.Categorical(record_type, categories=list(RECORD_TYPES)),
+        'action': pd.Categorical(action, categories=list(ACTIONS)),
+        'emotion_score': np.asarray(emotion_score, dtype='float64'),
+        'preview': pd.Series(preview, dtype=object).fillna(''),
+        'content_length': np.asarray([n or 0 for n in content_length], dtype='int64'),
+    })
+
+@cached_query("love_records")
+def get_pending_records(user, limit=PENDING_PAGE_SIZE, before=None):
+    """获取待回应的记录（发给该用户但未回应的），按 (created_at, id) 倒序分页
 
-def get_recent_records(days=3, limit=50):
-    """获取最近几天的记录"""
-    session = get_session()
+    before 为上一页最后一条的 (created_at, id)，None 表示第一页。
+    """
+    session = get_read_session()
     try:
-        cutoff = datetime.now() - timedelta(days=days)
-        records = session.query(LoveRecord).filter(
-            LoveRecord.created_at >= cutoff
-        ).order_by(
-            LoveRecord.created_at.desc()
+        # 发给该用户且未回应
+        query = session.query(LoveRecord).filter(
+            LoveRecord.receiver == user,
+            LoveRecord.is_responded == False
+        )
+        if before is not None:
+            query = query.filter(tuple_(LoveRecord.created_at, LoveRecord.id) < tuple_(*before))
+        records = query.order_by(
+            LoveRecord.created_at.desc(),
+            LoveRecord.id.desc()
         ).limit(limit).all()
         return records
     finally:
         session.close()
 
-def get_pending_records(user):
-    """获取待回应的记录（发给该用户但未读或未回应的）"""
-    session = get_session()
+@cached_query("love_records")
+def count_pending_records(user):
+    """待回应记录总数（只走 ix_love_records_pending 索引）"""
+    session = get_read_session()
     try:
-        # 发给该用户且未回应或未读
-        records = session.query(LoveRecord).filter(
+        return session.query(func.count(LoveRecord.id)).filter(
             LoveRecord.receiver == user,
             LoveRecord.is_responded == False
-        ).order_by(
-            LoveRecord.created_at.desc()
-        ).all()
-        return records
+        ).scalar()
     finally:
         session.close()
 
+def get_pending_pages(user, pages=1, page_size=PENDING_PAGE_SIZE):
+    """按游标逐页取前 pages 页待回应记录，每一页单独缓存"""
+    records = []
+    cursor = None
+    for _ in range(pages):
+        page = get_pending_records(user, limit=page_size, before=cursor)
+        records.extend(page)
+        if len(page) < page_size:
+            break
+        cursor = (page[-1].created_at, page[-1].id)
+    return records
+
 def respond_to_record(record_id, response_action, response_content):
-    """回应一条记录"""
-    session = get_session()
+    """回应一条记录（回球和积分在同一事务内写入）"""
     try:
-        # 更新原记录
-        record = session.query(LoveRecord).filter(LoveRecord.id == record_id).first()
-        if record:
-            record.is_read = True
-            record.is_responded = True
-            record.responded_at = datetime.now()
-            
-            # 创建回应记录
-            response = LoveRecord(
-                sender=st.session_state.user,
-                receiver=record.sender,
-                record_type=record.record_type,
-                action=response_action,
-                content=response_content,
-                emotion_score=record.emotion_score,  # 可以继承情绪分数
-                created_at=datetime.now(),
-                is_read=False
-            )
-            session.add(response)
-            session.commit()
-            
-            # 加分：回应对方
-            from points import add_points
-            add_points(st.session_state.user, 3, f'回应了{get_user_display(record.sender)}')
-            
-            return True
+        response = services.run(
+            services.return_ball, record_id, st.session_state.user, response_action, response_content
+        )
+        return response is not None
     except Exception as e:
         st.error(f"回应失败：{e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
+
+def rerun_fragment():
+    """只重跑当前 fragment；整页运行中（此时不允许局部重跑）退回整页重跑"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+@st.fragment
+def render_serve_form():
+    """发球区：表单提交只重跑发球区，成功后整页重跑以刷新时间线"""
+    with st.expander("🎯 发球 - 分享今日", expanded=True):
+        with st.form("serve_form"):
+            # 记录类型选择
+            record_type = st.selectbox(
+                "选择类型",
+                options=list(RECORD_TYPES.keys()),
+                format_func=lambda x: RECORD_TYPES[x],
+                key="serve_record_type"
+            )
+            
+            # 内容输入
+            content = st.text_area("记录内容", placeholder="今天发生了什么有趣的事？", key="serve_content")
+            
+            # 情绪评分
+            emotion = st.slider("今日心情", 1, 10, 5, 
+                               help="1=阴天 ☁️ → 10=晴天 ☀️", key="serve_emotion")
+            
+            # 动作选择（发球时可选）
+            action = st.radio(
+                "发球方式",
+                options=['serve', 'smash', 'drop'],
+                format_func=lambda x: f"{ACTIONS[x]['emoji']} {ACTIONS[x]['name']} - {ACTIONS[x]['desc']}",
+                horizontal=True,
+                key="serve_action"
+            )
+            
+            submitted = st.form_submit_button("🏐 发球", use_container_width=True)
+            if submitted and content:
+                receiver = 'him' if st.session_state.user == 'me' else 'me'
+                if save_love_record(st.session_state.user, receiver, record_type, action, content, emotion):
+                    st.toast("✅ 发球成功！等待对方回球...")
+                    st.rerun()
+
+def render_pending_card(record):
+    """一个待回应的球：卡片 + 回球表单，控件 key 只和记录 id 相关，重跑时保持输入"""
+    # 根据动作类型显示不同样式
+    action_info = ACTIONS.get(record.action, ACTIONS['serve'])
+    
+    # 创建卡片式显示
+    st.markdown(f"""
+    <div style='
+        background: {action_info["color"]}10;
+        border-left: 4px solid {action_info["color"]};
+        padding: 10px;
+        margin: 10px 0;
+        border-radius: 5px;
+    '>
+        <div style='display: flex; justify-content: space-between;'>
+            <span>{action_info["emoji"]} {get_user_display(record.sender)} 发来一球</span>
+            <span style='color: gray;'>{record.created_at.strftime("%H:%M")}</span>
+        </div>
+        <div style='font-size: 1.1em; margin: 5px 0;'>{record.content}</div>
+        <div style='display: flex; gap: 5px;'>
+            <span>类型：{RECORD_TYPES[record.record_type]}</span>
+            <span>心情：{'☀️' * int(record.emotion_score)}{'☁️' * (10 - int(record.emotion_score))}</span>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # 回应按钮
+    with st.expander("⚡ 回球"):
+        response_content = st.text_area(
+            "你的回应",
+            key=f"response_{record.id}",
+            placeholder="写下你的回应..."
+        )
+        
+        response_action = st.radio(
+            "回应方式",
+            options=['return', 'smash', 'drop'],
+            format_func=lambda x: f"{ACTIONS[x]['emoji']} {ACTIONS[x]['name']}",
+            horizontal=True,
+            key=f"action_{record.id}"
+        )
+        
+        if st.button(f"⚡ 回球给{get_user_display(record.sender)}", 
+                   key=f"btn_{record.id}",
+                   use_container_width=True):
+            if response_content:
+                if respond_to_record(record.id, response_action, response_content):
+                    st.toast("✅ 回球成功！")
+                    # 只重跑待回应区，不重跑整页和时间线图表
+                    rerun_fragment()
+            else:
+                st.warning("请输入回应内容")
+
+def load_pending_inbox(user, pages):
+    """待回应总数和前 pages 页记录"""
+    return count_pending_records(user), get_pending_pages(user, pages)
+
+@live_fragment
+def render_pending_inbox():
+    """待回应区：定时只重跑这一块，对方发球后自动出现；回球、加载更多也只重跑这一块"""
+    pending_pages = st.session_state.setdefault('pending_pages', 1)
+    pending_total, pending_records = load_when_changed(
+        'pending_inbox', ('love_records',), load_pending_inbox, st.session_state.user, pending_pages
+    )
+    previous_total = st.session_state.get('pending_seen_total')
+    st.session_state.pending_seen_total = pending_total
+    if previous_total is not None and pending_total > previous_total:
+        st.toast(f"{get_user_display('him' if st.session_state.user == 'me' else 'me')}发来了新球！")
+    
+    if pending_records:
+        st.markdown(f"### 🎯 待回应的球 <span class='pending-badge'>{pending_total}</span>",
+                    unsafe_allow_html=True)
+        for record in pending_records:
+            with st.container():
+                render_pending_card(record)
+        
+        # 加载更多（按游标往后取一页）
+        if len(pending_records) < pending_total:
+            if st.button(f"⬇️ 加载更多（还有 {pending_total - len(pending_records)} 个）",
+                         key="pending_load_more", use_container_width=True):
+                st.session_state.pending_pages = pending_pages + 1
+                rerun_fragment()
+    else:
+        st.info("🏸 暂无待回应的球，去发个球吧！")
+
+def build_timeline(days, today):
+    """时间线的表格、折线图、热力图和图下说明；没有记录时返回 None（today 只用来让跨天后重新读取）"""
+    note = None
+    if days <= RAW_TIMELINE_DAYS:
+        frame = get_timeline_frame(days=days, limit=RAW_TIMELINE_LIMIT)
+        chart_frame = frame
+        if len(frame) >= RAW_TIMELINE_LIMIT:
+            # 原始记录读满了上限，更早的记录没有画出来
+            note = (f"记录较多，图上只画了最近 {RAW_TIMELINE_LIMIT} 条"
+                    f"（{frame['created_at'].min():%m-%d %H:%M} 之后），更早的请切换到更长的范围查看汇总")
+    else:
+        frame = get_timeline_frame(days=days, limit=TIMELINE_TABLE_ROWS)
+        chart_frame = get_timeline_rollup_frame(days=days)
+    if frame.empty:
+        return None
+    frame = frame.head(TIMELINE_TABLE_ROWS)
+    # 表格直接由列式数据整列映射得到
+    df = pd.DataFrame({
+        '时间': frame['created_at'],
+        '发送者': np.where(frame['sender'] == 'me', get_user_display('me'), get_user_display('him')),
+        '类型': frame['record_type'].map(RECORD_TYPES),
+        '动作': frame['action'].map({k: v['emoji'] for k, v in ACTIONS.items()}),
+        '内容': truncate_preview(frame, 20),
+        '心情': frame['emotion_score']
+    })
+    
+    # 使用Plotly创建时间线
+    chart_frame, resolution = downsample_timeline(chart_frame)
+    fig = create_emotion_timeline(chart_frame, resolution)
+    # 情绪时段分布：只读最近30天的小时汇总格子
+    heatmap = create_emotion_heatmap(get_emotion_heatmap_cells(days=30), days=30)
+    return df, fig, heatmap, note
+
+@live_fragment
+def render_timeline():
+    """最近记录时间线（范围可选，点多时自动降采样）；定时只重跑这一块，没有新记录时直接复用上次画好的图"""
+    days = st.radio(
+        "时间范围",
+        options=list(TIMELINE_RANGES),
+        format_func=lambda x: TIMELINE_RANGES[x],
+        horizontal=True,
+        key="timeline_days",
+        label_visibility="collapsed"
+    )
+    st.markdown(f"### 📊 最近{TIMELINE_RANGES[days]}的球路轨迹")
+    
+    timeline = load_when_changed(
+        'timeline', ('love_records', 'emotion_hourly'), build_timeline, days, date.today()
+    )
+    if timeline is not None:
+        df, fig, heatmap, note = timeline
+        st.plotly_chart(fig, use_container_width=True, key="court_timeline")
+        if note:
+            st.caption(note)
+        
+        # 显示最近记录表格
+        with st.expander("📋 查看详细记录"):
+            st.dataframe(
+                df[['时间', '发送者', '类型', '动作', '内容', '心情']],
+                use_container_width=True,
+                hide_index=True
+            )
+        
+        with st.expander("🕒 最近30天的情绪时段分布"):
+            st.plotly_chart(heatmap, use_container_width=True, key="court_heatmap")
+    else:
+        st.info("还没有记录，去发第一个球吧！")
 
 def render_court():
-    """渲染双人球场主界面"""
+    """渲染双人球场主界面（发球区、待回应区、时间线各自是独立重跑的 fragment）"""
     st.markdown("""
     <div style='text-align: center; padding: 20px;'>
         <h1 style='color: white;'>🏸 双人球场</h1>
@@ -167,36 +414,7 @@ def render_court():
         """, unsafe_allow_html=True)
         
         # 发球区（分享今日）
-        with st.expander("🎯 发球 - 分享今日", expanded=True):
-            with st.form("serve_form"):
-                # 记录类型选择
-                record_type = st.selectbox(
-                    "选择类型",
-                    options=list(RECORD_TYPES.keys()),
-                    format_func=lambda x: RECORD_TYPES[x]
-                )
-                
-                # 内容输入
-                content = st.text_area("记录内容", placeholder="今天发生了什么有趣的事？")
-                
-                # 情绪评分
-                emotion = st.slider("今日心情", 1, 10, 5, 
-                                   help="1=阴天 ☁️ → 10=晴天 ☀️")
-                
-                # 动作选择（发球时可选）
-                action = st.radio(
-                    "发球方式",
-                    options=['serve', 'smash', 'drop'],
-                    format_func=lambda x: f"{ACTIONS[x]['emoji']} {ACTIONS[x]['name']} - {ACTIONS[x]['desc']}",
-                    horizontal=True
-                )
-                
-                submitted = st.form_submit_button("🏐 发球", use_container_width=True)
-                if submitted and content:
-                    receiver = 'him' if st.session_state.user == 'me' else 'me'
-                    if save_love_record(st.session_state.user, receiver, record_type, action, content, emotion):
-                        st.success("✅ 发球成功！等待对方回球...")
-                        st.rerun()
+        render_serve_form()
     
     # ========== 中间：球网 ==========
     with net_col:
@@ -217,99 +435,8 @@ def render_court():
         </div>
         """, unsafe_allow_html=True)
         
-        # 获取待回应的记录
-        other_user = 'him' if st.session_state.user == 'me' else 'me'
-        pending_records = get_pending_records(st.session_state.user)
-        
-        if pending_records:
-            st.markdown("### 🎯 待回应的球")
-            for record in pending_records:
-                with st.container():
-                    # 根据动作类型显示不同样式
-                    action_info = ACTIONS.get(record.action, ACTIONS['serve'])
-                    
-                    # 创建卡片式显示
-                    st.markdown(f"""
-                    <div style='
-                        background: {action_info["color"]}10;
-                        border-left: 4px solid {action_info["color"]};
-                        padding: 10px;
-                        margin: 10px 0;
-                        border-radius: 5px;
-                    '>
-                        <div style='display: flex; justify-content: space-between;'>
-                            <span>{action_info["emoji"]} {get_user_display(record.sender)} 发来一球</span>
-                            <span style='color: gray;'>{record.created_at.strftime("%H:%M")}</span>
-                        </div>
-                        <div style='font-size: 1.1em; margin: 5px 0;'>{record.content}</div>
-                        <div style='display: flex; gap: 5px;'>
-                            <span>类型：{RECORD_TYPES[record.record_type]}</span>
-                            <span>心情：{'☀️' * int(record.emotion_score)}{'☁️' * (10 - int(record.emotion_score))}</span>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # 回应按钮
-                    with st.expander("⚡ 回球"):
-                        # 获取当前时间作为唯一键
-                        timestamp = datetime.now().timestamp()
-                        
-                        response_content = st.text_area(
-                            "你的回应",
-                            key=f"response_{record.id}_{timestamp}",
-                            placeholder="写下你的回应..."
-                        )
-                        
-                        response_action = st.radio(
-                            "回应方式",
-                            options=['return', 'smash', 'drop'],
-                            format_func=lambda x: f"{ACTIONS[x]['emoji']} {ACTIONS[x]['name']}",
-                            horizontal=True,
-                            key=f"action_{record.id}_{timestamp}"
-                        )
-                        
-                        if st.button(f"⚡ 回球给{get_user_display(record.sender)}", 
-                                   key=f"btn_{record.id}_{timestamp}",
-                                   use_container_width=True):
-                            if response_content:
-                                if respond_to_record(record.id, response_action, response_content):
-                                    st.success("✅ 回球成功！")
-                                    st.rerun()
-                            else:
-                                st.warning("请输入回应内容")
-        else:
-            st.info("🏸 暂无待回应的球，去发个球吧！")
+        render_pending_inbox()
     
     # ========== 底部：最近记录时间线 ==========
     st.markdown("---")
-    st.markdown("### 📊 最近3天的球路轨迹")
-    
-    records = get_recent_records(days=3)
-    if records:
-        # 转换为DataFrame用于可视化
-        data = []
-        for r in records:
-            data.append({
-                '时间': r.created_at,
-                '发送者': get_user_display(r.sender),
-                '类型': RECORD_TYPES[r.record_type],
-                '动作': ACTIONS[r.action]['emoji'],
-                '内容': r.content[:20] + '...' if len(r.content) > 20 else r.content,
-                '心情': r.emotion_score
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # 使用Plotly创建时间线
-        fig = create_emotion_timeline(records)
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # 显示最近记录表格
-        with st.expander("📋 查看详细记录"):
-            st.dataframe(
-                df[['时间', '发送者', '类型', '动作', '内容', '心情']],
-                use_container_width=True,
-                hide_index=True
-            )
-    else:
-        st.info("还没有记录，去发第一个球吧！")
\ No newline at end of file
+    render_timeline()
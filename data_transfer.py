@@ -0,0 +1,345 @@
+"""
+数据导出/导入 - 在不同部署之间搬数据、给离线分析用，不用直接拷贝 crush_court.db
+
+导出：在一个只读事务（同一快照）里逐表流式读取，每次 fetchmany 一块，写成 NDJSON 或 Parquet，
+内存占用只和块大小有关。回球记录和积分流水还会接着导出归档库里的旧行（按 id 去重），导出的是全部历史。目录里另有 manifest.json 记录格式、各表行数和数据库版本。
+导入：先检查所有文件和目标表，再按块读文件写进暂存表，每块一次 executemany，若干块一个写事务；
+最后在一个写事务里替换目标表并重建积分日汇总、情绪小时汇总和每日摘要（也会算上本机归档库里的行），
+中途失败不会留下导入了一半的表。--replace 覆盖回球记录或积分流水时，本机归档库里这两张表的旧行和归档水位
+也一起清掉（导出本来就包含归档的行），旧数据不会再从历史查询、搜索或重建的汇总里冒出来。
+两边都会打印每张表的行数和 行/秒。
+
+用法：
+    python data_transfer.py export backup/ --format parquet
+    python data_transfer.py import backup/ --replace
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, MetaData, delete, select
+
+from archive import clear_archived
+from database import (
+    HealthLog,
+    HealthReminder,
+    HonorRecord,
+    LoveRecord,
+    MatchReminder,
+    PointsLog,
+    backfill_points_daily,
+    bump_table_versions,
+    get_engine,
+    get_read_engine,
+    init_database,
+    iter_archived,
+)
+
+# 导出的表，按导入顺序排列
+MODELS = (LoveRecord, HealthReminder, HealthLog, MatchReminder, HonorRecord, PointsLog)
+FORMATS = ("ndjson", "parquet")
+CHUNK_ROWS = 5000  # 每次读取/executemany 的行数
+CHUNKS_PER_TRANSACTION = 10  # 导入时每个写事务包含的块数
+MANIFEST = "manifest.json"
+STAGING_PREFIX = "_import_"  # 导入暂存表的前缀，导入结束后删除
+
+
+def _table(name):
+    for model in MODELS:
+        if model.__tablename__ == name:
+            return model.__table__
+    raise ValueError(f"不支持的表：{name}")
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def _arrow_schema(table):
+    import pyarrow as pa
+
+    types = {Integer: pa.int64(), Float: pa.float64(), Boolean: pa.bool_(), DateTime: pa.timestamp("us"), Date: pa.date32()}
+    return pa.schema(
+        [
+            pa.field(column.name, next((t for sa, t in types.items() if isinstance(column.type, sa)), pa.string()))
+            for column in table.columns
+        ]
+    )
+
+
+class _NdjsonWriter:
+    suffix = ".ndjson"
+
+    def __init__(self, path, table):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows):
+        self._file.writelines(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    suffix = ".parquet"
+
+    def __init__(self, path, table):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("导出 Parquet 需要安装 pyarrow") from e
+        self._pa = pa
+        self._schema = _arrow_schema(table)
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        # 每块写成一个 row group，不会把整张表攒在内存里
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {"ndjson": _NdjsonWriter, "parquet": _ParquetWriter}
+
+
+def _report(name, rows, seconds):
+    rate = rows / seconds if seconds > 0 else float("inf")
+    print(f"  {name:<18} {rows:>9} 行  {seconds:7.2f}s  {rate:>10.0f} 行/秒")
+
+
+def export_tables(out_dir, fmt="ndjson", models=MODELS, chunk_rows=CHUNK_ROWS):
+    """把各表导出到 out_dir，返回 {表名: 行数}。"""
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的格式：{fmt}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    started = time.perf_counter()
+
+    # 只读连接上的一个事务：所有表读的是同一个快照
+    with get_read_engine().connect() as connection:
+        schema_version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        for model in models:
+            table = model.__table__
+            table_started = time.perf_counter()
+            writer = WRITERS[fmt](out_dir / f"{table.name}{WRITERS[fmt].suffix}", table)
+            rows = 0
+            try:
+                result = connection.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+                    select(table).order_by(*table.primary_key.columns)
+                )
+                for chunk in result.mappings().partitions(chunk_rows):
+                    writer.write([dict(row) for row in chunk])
+                    rows += len(chunk)
+                chunk = []
+                for row in iter_archived(connection, table, chunk_rows=chunk_rows):
+                    chunk.append(dict(row._mapping))
+                    if len(chunk) >= chunk_rows:
+                        writer.write(chunk)
+                        rows += len(chunk)
+                        chunk = []
+                if chunk:
+                    writer.write(chunk)
+                    rows += len(chunk)
+            finally:
+                writer.close()
+            counts[table.name] = rows
+            _report(table.name, rows, time.perf_counter() - table_started)
+
+    manifest = {
+        "format": fmt,
+        "schema_version": schema_version,
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+        "tables": counts,
+    }
+    (out_dir / MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    _report("合计", sum(counts.values()), time.perf_counter() - started)
+    return counts
+
+
+def _converters(table):
+    """NDJSON 里的日期时间是字符串，按列类型转回 Python 对象。"""
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, DateTime):
+            converters[column.name] = datetime.fromisoformat
+        elif isinstance(column.type, Date):
+            converters[column.name] = date.fromisoformat
+    return converters
+
+
+def _read_ndjson(path, table, chunk_rows):
+    converters = _converters(table)
+    chunk = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            for name, convert in converters.items():
+                if row.get(name) is not None:
+                    row[name] = convert(row[name])
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _read_parquet(path, table, chunk_rows):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("导入 Parquet 需要安装 pyarrow") from e
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        yield batch.to_pylist()
+
+
+READERS = {"ndjson": _read_ndjson, "parquet": _read_parquet}
+
+
+def _rebuild_rollups(connection):
+    """导入绕过了 services，派生的汇总表按导入后的数据重建。"""
+    from ai_context import backfill_daily_summaries
+    from rollups import backfill_emotion_hourly
+
+    connection.exec_driver_sql("DELETE FROM points_daily")
+    backfill_points_daily(connection)
+    backfill_emotion_hourly(connection, rebuild=True)
+    backfill_daily_summaries(connection, rebuild=True)
+    bump_table_versions(connection, ["points_daily"])
+
+
+def _staging_table(table):
+    """与 table 列相同的暂存表（不带索引），导入先写进这里。"""
+    staging = table.to_metadata(MetaData(), name=f"{STAGING_PREFIX}{table.name}")
+    staging.indexes.clear()
+    return staging
+
+
+def _parquet_columns(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("导入 Parquet 需要安装 pyarrow") from e
+    return pq.ParquetFile(path).schema_arrow.names
+
+
+def _check_import(in_dir, manifest, replace):
+    """写入之前先检查：格式、每张表和它的文件都要有效，不覆盖时目标表都必须为空。"""
+    fmt = manifest.get("format")
+    if fmt not in READERS:
+        raise ValueError(f"不支持的格式：{fmt}")
+    tables = [_table(name) for name in manifest.get("tables", {})]
+    for table in tables:
+        path = in_dir / f"{table.name}{WRITERS[fmt].suffix}"
+        if not path.is_file():
+            raise FileNotFoundError(f"缺少数据文件：{path}")
+        if fmt == "parquet":
+            names = _parquet_columns(path)
+            unknown = set(names) - set(table.columns.keys())
+            if unknown:
+                raise ValueError(f"{path.name} 有 {table.name} 不存在的列：{', '.join(sorted(unknown))}")
+    if not replace:
+        with get_read_engine().connect() as connection:
+            filled = [table.name for table in tables if connection.execute(select(table).limit(1)).first()]
+        if filled:
+            raise RuntimeError(f"{', '.join(filled)} 已有数据，如需覆盖请加 --replace")
+    return fmt, tables
+
+
+def import_tables(in_dir, replace=False, chunk_rows=CHUNK_ROWS, chunks_per_transaction=CHUNKS_PER_TRANSACTION):
+    """导入 export_tables 生成的目录，返回 {表名: 行数}。replace=True 时覆盖这些表（连同它们在归档库里的行）。
+
+    先把每张表分块写进暂存表（每个写事务若干块，不长时间占用写锁），全部读完后在一个写事务里
+    清空目标表、从暂存表整表复制过去并重建汇总表；任何一步出错，目标表都保持导入前的样子。
+    """
+    in_dir = Path(in_dir)
+    manifest = json.loads((in_dir / MANIFEST).read_text(encoding="utf-8"))
+    init_database()
+    fmt, tables = _check_import(in_dir, manifest, replace)
+    engine = get_engine()
+    stagings = [_staging_table(table) for table in tables]
+    counts = {}
+    started = time.perf_counter()
+
+    try:
+        with engine.begin() as connection:
+            for staging in stagings:
+                staging.drop(connection, checkfirst=True)  # 上次中断留下的
+                staging.create(connection)
+
+        for table, staging in zip(tables, stagings):
+            table_started = time.perf_counter()
+            rows = 0
+            chunks = READERS[fmt](in_dir / f"{table.name}{WRITERS[fmt].suffix}", table, chunk_rows)
+            exhausted = False
+            while not exhausted:
+                # 一个写事务导入若干块，每块一次 executemany
+                with engine.begin() as connection:
+                    for _ in range(chunks_per_transaction):
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                            break
+                        connection.execute(staging.insert(), chunk)
+                        rows += len(chunk)
+            counts[table.name] = rows
+            _report(table.name, rows, time.perf_counter() - table_started)
+
+        with engine.begin() as connection:
+            if replace:
+                clear_archived(connection, tables)
+            for table, staging in zip(tables, stagings):
+                if replace:
+                    connection.execute(delete(table))
+                elif connection.execute(select(table).limit(1)).first():
+                    # 检查之后别人又写了数据
+                    raise RuntimeError(f"{table.name} 已有数据，如需覆盖请加 --replace")
+                columns = list(table.columns)
+                connection.execute(table.insert().from_select(columns, select(*(staging.c[c.name] for c in columns))))
+            bump_table_versions(connection, [table.name for table in tables])
+            _rebuild_rollups(connection)
+    finally:
+        with engine.begin() as connection:
+            for staging in stagings:
+                staging.drop(connection, checkfirst=True)
+
+    _report("合计", sum(counts.values()), time.perf_counter() - started)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出/导入 CrushCourt 数据")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="导出到目录")
+    export_parser.add_argument("out_dir")
+    export_parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    export_parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="每块行数")
+
+    import_parser = commands.add_parser("import", help="从导出目录导入")
+    import_parser.add_argument("in_dir")
+    import_parser.add_argument("--replace", action="store_true", help="覆盖要导入的表")
+    import_parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="每块行数")
+    import_parser.add_argument("--chunks-per-tx", type=int, default=CHUNKS_PER_TRANSACTION, help="每个写事务的块数")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        init_database()
+        print(f"📤 导出到 {args.out_dir}（{args.format}）")
+        export_tables(args.out_dir, args.format, chunk_rows=args.chunk)
+    else:
+        print(f"📥 从 {args.in_dir} 导入")
+        import_tables(args.in_dir, replace=args.replace, chunk_rows=args.chunk, chunks_per_transaction=args.chunks_per_tx)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,208 @@
 """
 数据库模块 - 存储所有的爱情记录
 """
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
 from datetime import datetime
 from pathlib import Path
 
-from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String, Text, create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    String,
+    Text,
+    UniqueConstraint,
+    create_engine,
+    event,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.orm import column_property, declarative_base, deferred, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 
-# 数据库文件路径（放在仓库内，避免部署环境父目录权限问题）
-DATA_DIR = Path(__file__).resolve().parent / "data"
-DATA_DIR.mkdir(parents=True, exist_ok=True)
+# 数据库文件路径（默认放在仓库内，避免部署环境父目录权限问题；压测等场景可用 CRUSHCOURT_DATA_DIR 指向临时目录）
+DATA_DIR = Path(os.getenv("CRUSHCOURT_DATA_DIR") or Path(__file__).resolve().parent / "data")
 DB_PATH = DATA_DIR / "crush_court.db"
+# 冷数据归档库：旧的回球记录和积分流水移到这里（见 archive.py）
+ARCHIVE_PATH = DATA_DIR / "crush_court_archive.db"
+
+
+
+@dataclass(frozen=True)
+class EngineProfile:
+    """SQLite 连接调优参数，在每个新连接建立时通过 PRAGMA 设置"""
+
+    name: str
+    journal_mode: str = "WAL"  # WAL 下读写互不阻塞
+    synchronous: str = "NORMAL"  # WAL + NORMAL：只在 checkpoint 时 fsync
+    busy_timeout_ms: int = 5000  # 遇到锁时最多等待的毫秒数，而不是立刻报 database is locked
+    cache_size_kib: int = 16 * 1024  # 每个连接的页缓存
+    mmap_size: int = 64 * 1024 * 1024  # 内存映射读取的字节数，0 表示关闭
+    reader_pool_size: int = 4  # 只读连接池大小
+    auto_vacuum: str = "INCREMENTAL"  # 新建数据库时生效；归档后用 incremental_vacuum 分步归还空闲页
+
+
+ENGINE_PROFILES = {
+    "tuned": EngineProfile("tuned"),
+    # 旧行为：回滚日志 + 每次提交 fsync，适合不支持 WAL 的网络文件系统
+    "safe": EngineProfile("safe", journal_mode="DELETE", synchronous="FULL", mmap_size=0),
+}
+
+
+def load_engine_profile() -> EngineProfile:
+    """从环境变量读取连接配置。
+
+    CRUSHCOURT_DB_PROFILE 选择预设（默认 tuned），
+    CRUSHCOURT_DB_<字段名大写> 可以单独覆盖某一项，例如 CRUSHCOURT_DB_BUSY_TIMEOUT_MS=10000。
+    """
+    name = os.getenv("CRUSHCOURT_DB_PROFILE", "tuned").strip().lower()
+    profile = ENGINE_PROFILES.get(name, ENGINE_PROFILES["tuned"])
+
+    overrides = {}
+    for field in fields(EngineProfile):
+        value = os.getenv(f"CRUSHCOURT_DB_{field.name.upper()}", "").strip()
+        if field.name == "name" or not value:
+            continue
+        overrides[field.name] = int(value) if field.type is int else value.upper()
+    return replace(profile, **overrides)
+
+
+def _apply_common_pragmas(dbapi_connection, profile):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(profile.busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA cache_size = -{int(profile.cache_size_kib)}")
+    cursor.execute(f"PRAGMA mmap_size = {int(profile.mmap_size)}")
+    cursor.close()
+
+
+def create_writer_engine(profile: EngineProfile, path=DB_PATH):
+    """唯一的写连接：所有写入排队使用同一个连接，事务以 BEGIN IMMEDIATE 开始。"""
+    writer = create_engine(
+        f"sqlite:///{path}",
+        echo=False,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=profile.busy_timeout_ms / 1000 * 6,
+        connect_args={"timeout": profile.busy_timeout_ms / 1000, "check_same_thread": False},
+    )
+
+    @event.listens_for(writer, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        # 关闭 pysqlite 自带的隐式事务，由下面的 begin 事件显式控制
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        # 必须在建表（和切换 WAL）之前设置；已有数据库要 VACUUM 一次才生效
+        cursor.execute(f"PRAGMA auto_vacuum = {profile.auto_vacuum}")
+        cursor.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {profile.synchronous}")
+        cursor.close()
+        _apply_common_pragmas(dbapi_connection, profile)
+
+    @event.listens_for(writer, "begin")
+    def _on_begin(connection):
+        # 一开始就拿写锁，避免 WAL 下读事务升级为写事务时的 SQLITE_BUSY
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    @event.listens_for(writer, "after_execute")
+    def _track_written_tables(connection, clauseelement, multiparams, params, execution_options, result):
+        # ORM flush 和 Core 的 insert/update/delete 都会经过这里，记录本事务写过的表
+        if isinstance(clauseelement, UpdateBase):
+            connection.info.setdefault("written_tables", set()).add(clauseelement.table.name)
+
+    @event.listens_for(writer, "rollback")
+    def _forget_written_tables(connection):
+        connection.info.pop("written_tables", None)
+
+    return writer
+
+
+def create_reader_engine(profile: EngineProfile, path=DB_PATH):
+    """只读连接池：mode=ro + query_only，供页面渲染时的查询使用。"""
+    reader = create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true",
+        echo=False,
+        pool_size=profile.reader_pool_size,
+        max_overflow=0,
+        connect_args={"timeout": profile.busy_timeout_ms / 1000, "check_same_thread": False},
+    )
+
+    @event.listens_for(reader, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+        _apply_common_pragmas(dbapi_connection, profile)
+
+    @event.listens_for(reader, "begin")
+    def _on_begin(connection):
+        # 同一会话内的多次查询读同一个快照
+        connection.exec_driver_sql("BEGIN")
+
+    return reader
+
+
+# 数据库引擎在第一次使用时创建（导入本模块不会建目录、开连接）
+_engines = {}
+_engines_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _get_or_create_engine(name, factory):
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                DATA_DIR.mkdir(parents=True, exist_ok=True)
+                engine = factory(load_engine_profile())
+                _engines[name] = engine
+    return engine
+
+
+def get_engine():
+    """进程内唯一的写引擎"""
+    return _get_or_create_engine("writer", create_writer_engine)
+
+
+def get_read_engine():
+    """进程内唯一的只读引擎"""
+    return _get_or_create_engine("reader", create_reader_engine)
+
+
+def get_archive_engine():
+    """归档库的写引擎（只有归档任务使用）"""
+    return _get_or_create_engine("archive", lambda profile: create_writer_engine(profile, ARCHIVE_PATH))
+
+
+def get_archive_read_engine():
+    """归档库的只读引擎；归档库文件要先由归档任务建好"""
+    return _get_or_create_engine("archive_reader", lambda profile: create_reader_engine(profile, ARCHIVE_PATH))
+
 
-# 创建数据库引擎
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
+# 提交后不过期属性：提交后再访问对象字段不会重新占用唯一的写连接
+Session = sessionmaker(expire_on_commit=False)
+ReadSession = sessionmaker()
 
 
 class LoveRecord(Base):
     """双人回球记录 - 核心功能"""
 
     __tablename__ = "love_records"
+    __table_args__ = (
+        Index("ix_love_records_pending", "receiver", "is_responded", "created_at"),
+        Index("ix_love_records_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     sender = Column(String)  # 'me' 或 'him'
@@ -40,6 +221,7 @@ class HealthReminder(Base):
     """健康提醒 - 喝水吃饭提醒"""
 
     __tablename__ = "health_reminders"
+    __table_args__ = (Index("ix_health_reminders_active_time", "is_active", "reminder_time"),)
 
     id = Column(Integer, primary_key=True)
     reminder_type = Column(String)  # 'water', 'breakfast', 'lunch', 'dinner', 'sleep'
@@ -54,6 +236,7 @@ class HealthLog(Base):
     """健康记录 - 实际完成情况"""
 
     __tablename__ = "health_logs"
+    __table_args__ = (Index("ix_health_logs_completed_at", "completed_at"),)
 
     id = Column(Integer, primary_key=True)
     reminder_id = Column(Integer)  # 关联的提醒
@@ -66,6 +249,10 @@ class MatchReminder(Base):
     """赛事任务 - 男友比赛提醒"""
 
     __tablename__ = "match_reminders"
+    __table_args__ = (
+        Index("ix_match_reminders_pending", "is_completed", "match_date"),
+        Index("ix_match_reminders_match_date", "match_date"),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String)  # 比赛名称
@@ -87,7 +274,11 @@ class HonorRecord(Base):
     title = Column(String)  # 标题，比如"第一次一起看比赛"
     description = Column(Text)
     honor_type = Column(String)  # 'milestone'纪念日, 'achievement'成就, 'memory'回忆
-    photo_url = Column(String, nullable=True)  # 可以存图片路径或base64
+    # 旧数据里的图片路径/base64/网址；延迟加载，列表查询不会把它读出来。新图片存进 blobstore，这里只记哈希
+    photo_url = deferred(Column(String, nullable=True))
+    photo_hash = Column(String(64), nullable=True)  # blobstore 里原图的 sha256
+    # 有没有旧图片只读这个布尔值，不用加载 photo_url
+    has_legacy_photo = column_property(photo_url.expression.isnot(None) & (photo_url.expression != ""))
     emotion_score = Column(Float)  # 当时的开心程度
     created_at = Column(DateTime, default=datetime.utcnow)
     created_by = Column(String)
@@ -97,6 +288,7 @@ class PointsLog(Base):
     """积分系统 - 奖赏机制"""
 
     __tablename__ = "points_log"
+    __table_args__ = (Index("ix_points_log_user_created", "user", "created_at"),)
 
     id = Column(Integer, primary_key=True)
     user = Column(String)  # 'me' 或 'him'
@@ -106,12 +298,284 @@ class PointsLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class PointsDaily(Base):
+    """积分日汇总 - 每人每天一行，由 add_points 在同一事务内增量维护"""
+
+    __tablename__ = "points_daily"
+    __table_args__ = (UniqueConstraint("user", "day", name="uq_points_daily_user_day"),)
+
+    id = Column(Integer, primary_key=True)
+    user = Column(String, nullable=False)  # 'me' 或 'him'
+    day = Column(Date, nullable=False)  # 本地日期
+    points = Column(Integer, nullable=False, default=0)  # 当天积分合计
+    entries = Column(Integer, nullable=False, default=0)  # 当天积分条数
+
+
+class EmotionHourly(Base):
+    """情绪小时汇总 - 每天每小时每人一行，写入回球记录时增量维护，供热力图使用"""
+
+    __tablename__ = "emotion_hourly"
+    __table_args__ = (UniqueConstraint("day", "hour", "sender", name="uq_emotion_hourly_cell"),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)  # 本地日期
+    hour = Column(Integer, nullable=False)  # 0-23
+    sender = Column(String, nullable=False)  # 'me' 或 'him'
+    score_sum = Column(Float, nullable=False, default=0.0)  # 情绪分数合计
+    entries = Column(Integer, nullable=False, default=0)  # 记录条数
+
+
+class DailySummary(Base):
+    """每日情况摘要 - 每天一行，写入回球/打卡/赛事时增量维护，供 AI 提示拼接上下文"""
+
+    __tablename__ = "daily_summaries"
+
+    day = Column(Date, primary_key=True)  # 本地日期
+    love_records = Column(Integer, nullable=False, default=0)  # 回球记录条数
+    score_sum = Column(Float, nullable=False, default=0.0)  # 回球情绪分数合计
+    health_checkins = Column(Integer, nullable=False, default=0)  # 健康打卡次数
+    matches_created = Column(Integer, nullable=False, default=0)  # 新建赛事数
+    matches_completed = Column(Integer, nullable=False, default=0)  # 完成赛事数
+    highlights = Column(Text, nullable=False, default="[]")  # 当天最近几件事的短摘要，JSON 列表
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class OutboxMessage(Base):
+    """通知发件箱 - 和触发它的记录在同一事务里写入，由后台投递线程批量发出"""
+
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index("ix_outbox_pending", "delivered_at", "available_at", "id"),
+        Index("ix_outbox_dedupe_key", "dedupe_key", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)  # 'ball.served', 'ball.returned', 'reminder.due'
+    recipient = Column(String, nullable=True)  # 'me' / 'him'，为空表示两人都通知
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.now)
+    available_at = Column(DateTime, default=datetime.now)  # 早于这个时间不投递（重试退避、投递租约）
+    attempts = Column(Integer, nullable=False, default=0)
+    delivered_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    dedupe_key = Column(String, nullable=True)  # 同一个键只写一条，比如多个进程触发同一次提醒
+
+
+class ArchiveWatermark(Base):
+    """归档水位 - 早于 archived_before 的记录可能已经移到归档库，查询范围更早时才需要读归档库"""
+
+    __tablename__ = "archive_watermarks"
+
+    name = Column(String, primary_key=True)  # 表名
+    archived_before = Column(DateTime, nullable=False)
+    archived_rows = Column(Integer, nullable=False, default=0)  # 累计移走的行数
+    updated_at = Column(DateTime, default=datetime.now)
+
+
+class AIResponseCache(Base):
+    """AI 回复缓存 - 以 (模型, 系统提示, 用户输入, 温度, 上下文) 的哈希为键"""
+
+    __tablename__ = "ai_response_cache"
+    __table_args__ = (Index("ix_ai_response_cache_last_used", "last_used_at"),)
+
+    key = Column(String, primary_key=True)  # sha256 十六进制
+    model = Column(String)
+    response = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)  # 用于 TTL
+    last_used_at = Column(DateTime, default=datetime.utcnow)  # 用于 LRU 淘汰
+    hits = Column(Integer, nullable=False, default=0)
+
+
+class TableVersion(Base):
+    """表版本号 - 每次提交写过某张表就更新为新的全局变更序号，供查询缓存和变更流判断数据是否变化"""
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)  # 表名
+    version = Column(Integer, nullable=False, default=0)
+
+
+def bump_table_versions(connection, tables):
+    """在当前事务内给写过的表分配新版本号。
+
+    版本号取自全库递增的变更序号（所有表版本号的最大值 + 1），同一次提交写过的表拿到同一个序号，
+    所以它既能判断某张表变没变，也能当变更流的游标用（见 change_feed）。写事务是串行的，序号不会重复。
+    """
+    if not tables:
+        return
+    sequence = connection.execute(text("SELECT COALESCE(MAX(version), 0) + 1 FROM table_versions")).scalar()
+    for name in sorted(tables):
+        connection.execute(
+            text(
+                "INSERT INTO table_versions (name, version) VALUES (:name, :sequence) "
+                "ON CONFLICT (name) DO UPDATE SET version = excluded.version"
+            ),
+            {"name": name, "sequence": sequence},
+        )
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_written_table_versions(session):
+    """提交前把本事务写过的表的版本号一起写进同一个事务。"""
+    session.flush()
+    if not session.in_transaction():
+        return
+    connection = session.connection()
+    tables = connection.info.pop("written_tables", None)
+    if tables:
+        bump_table_versions(connection, tables)
+
+
+def after_commit(session, callback):
+    """登记一个回调，在最外层事务提交成功后调用；所在事务或 SAVEPOINT 回滚时丢弃。"""
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    session.info.setdefault("after_commit", []).append((transaction, callback))
+
+
+def _registered_under(transaction, ancestor):
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit_callbacks(session):
+    # SAVEPOINT 释放也会触发 after_commit，只在最外层提交后执行
+    if session.in_nested_transaction():
+        return
+    for _, callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception as e:
+            print(f"提交后回调失败：{e}")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_commit_callbacks(session, previous_transaction):
+    callbacks = session.info.get("after_commit")
+    if not callbacks:
+        return
+    if not previous_transaction.nested:
+        session.info.pop("after_commit", None)
+        return
+    callbacks[:] = [
+        (transaction, callback)
+        for transaction, callback in callbacks
+        if not _registered_under(transaction, previous_transaction)
+    ]
+
+
+def iter_archived(connection, table, columns=None, chunk_rows=5000):
+    """流式读取归档库里 table 的行（columns 为空时取整行，否则取 id 加 columns），重建汇总和导出用。
+
+    归档中途退出时同一行可能两边都有，跳过 connection（主库）里也有的 id；没有归档库时什么也不返回。
+    先读主库再读归档库：两次读取之间被归档的行两边都能读到，按 id 去重后不会漏也不会重复。
+    """
+    if not ARCHIVE_PATH.exists():
+        return
+    with get_archive_read_engine().connect() as archive:
+        exists = archive.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+        ).first()
+        max_id = archive.execute(select(func.max(table.c.id))).scalar() if exists else None
+        if max_id is None:
+            return
+        hot_ids = set(connection.execute(select(table.c.id).where(table.c.id <= max_id)).scalars())
+        statement = select(table.c.id, *columns) if columns else select(table)
+        result = archive.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+            statement.order_by(table.c.id)
+        )
+        for row in result:
+            if row.id not in hot_ids:
+                yield row
+
+
+def backfill_points_daily(connection):
+    """用 points_log（含归档库）重建日汇总（仅在汇总表为空时执行，由迁移和导入调用）"""
+    if connection.execute(text("SELECT 1 FROM points_daily LIMIT 1")).first():
+        return
+    connection.execute(
+        text(
+            """
+            INSERT INTO points_daily (user, day, points, entries)
+            SELECT user, date(created_at), SUM(points), COUNT(*)
+            FROM points_log
+            WHERE user IS NOT NULL AND created_at IS NOT NULL
+            GROUP BY user, date(created_at)
+            """
+        )
+    )
+
+    # 已归档的流水按天累加进去，汇总仍然覆盖全部历史
+    table = PointsLog.__table__
+    archived = {}
+    for _, user, day, points in iter_archived(
+        connection, table, [table.c.user, func.date(table.c.created_at), table.c.points]
+    ):
+        if user is None or day is None:
+            continue
+        cell = archived.setdefault((user, day), [0, 0])
+        cell[0] += points or 0
+        cell[1] += 1
+    if archived:
+        connection.execute(
+            text(
+                """
+                INSERT INTO points_daily (user, day, points, entries) VALUES (:user, :day, :points, :entries)
+                ON CONFLICT (user, day) DO UPDATE
+                SET points = points + excluded.points, entries = entries + excluded.entries
+                """
+            ),
+            [
+                {"user": user, "day": day, "points": points, "entries": entries}
+                for (user, day), (points, entries) in archived.items()
+            ],
+        )
+
+
 def init_database():
-    """初始化数据库，创建表"""
-    Base.metadata.create_all(engine)
+    """初始化数据库：创建缺失的表，再执行版本迁移。每个进程只执行一次，之后的调用直接返回"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        from migrations import run_migrations
+
+        engine = get_engine()
+        Base.metadata.create_all(engine)
+        run_migrations(engine)
+        _schema_ready = True
     print(f"✅ 数据库初始化成功：{DB_PATH}")
 
 
 def get_session():
-    """获取数据库会话"""
-    return Session()
+    """获取数据库会话（写连接）"""
+    return Session(bind=get_engine())
+
+
+@contextmanager
+def unit_of_work():
+    """一个业务动作一个会话、一次提交；出错整体回滚。"""
+    session = get_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_read_session():
+    """获取只读数据库会话，页面渲染的查询都走这里"""
+    return ReadSession(bind=get_read_engine())
+
+
+def get_archive_read_session():
+    """获取归档库的只读会话（表结构与主库相同）"""
+    return ReadSession(bind=get_archive_read_engine())
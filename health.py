@@ -3,8 +3,10 @@ from datetime import datetime
 
 import streamlit as st
 
-from database import HealthLog, HealthReminder, get_session
-from points import add_points
+import services
+from change_feed import live_fragment, load_when_changed
+from database import HealthLog, HealthReminder, get_read_session
+from query_cache import cached_query
 
 
 REMINDER_TYPES = {
@@ -17,29 +19,17 @@ REMINDER_TYPES = {
 
 
 def create_reminder(reminder_type: str, reminder_time: str, message: str, set_by: str) -> bool:
-    session = get_session()
     try:
-        reminder = HealthReminder(
-            reminder_type=reminder_type,
-            reminder_time=reminder_time,
-            message=message,
-            set_by=set_by,
-            is_active=True,
-            created_at=datetime.now(),
-        )
-        session.add(reminder)
-        session.commit()
+        services.run(services.create_health_reminder, reminder_type, reminder_time, message, set_by)
         return True
     except Exception as e:
         st.error(f"创建提醒失败：{e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
 
 
+@cached_query("health_reminders")
 def get_active_reminders():
-    session = get_session()
+    session = get_read_session()
     try:
         return (
             session.query(HealthReminder)
@@ -52,28 +42,25 @@ def get_active_reminders():
 
 
 def complete_reminder(reminder_id: int, user: str, note: str = "") -> bool:
-    session = get_session()
     try:
-        log = HealthLog(
-            reminder_id=reminder_id,
-            user=user,
-            completed_at=datetime.now(),
-            note=note or None,
-        )
-        session.add(log)
-        session.commit()
-        add_points(user, 2, "完成健康打卡")
+        services.run(services.check_in_health, reminder_id, user, note)
         return True
     except Exception as e:
         st.error(f"打卡失败：{e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
 
 
+def deactivate_reminder(reminder_id: int) -> bool:
+    try:
+        return services.run(services.deactivate_health_reminder, reminder_id) is not None
+    except Exception as e:
+        st.error(f"停用提醒失败：{e}")
+        return False
+
+
+@cached_query("health_logs")
 def get_recent_health_logs(limit: int = 20):
-    session = get_session()
+    session = get_read_session()
     try:
         return session.query(HealthLog).order_by(HealthLog.completed_at.desc()).limit(limit).all()
     finally:
@@ -119,15 +106,25 @@ def render_health() -> None:
                     )
                     st.caption(reminder.message)
                     note = st.text_input("打卡备注", key=f"note_{reminder.id}")
-                    if st.button("✅ 我已完成", key=f"done_{reminder.id}", use_container_width=True):
+                    done_col, off_col = st.columns([3, 1])
+                    if done_col.button("✅ 我已完成", key=f"done_{reminder.id}", use_container_width=True):
                         if complete_reminder(reminder.id, st.session_state.user, note):
                             st.success("打卡成功 +2 积分")
                             st.rerun()
+                    if off_col.button("🔕 停用", key=f"off_{reminder.id}", use_container_width=True):
+                        if deactivate_reminder(reminder.id):
+                            st.rerun()
         else:
             st.info("还没有提醒，先创建一条吧。")
 
+    render_recent_health_logs()
+
+
+@live_fragment
+def render_recent_health_logs() -> None:
+    """最近打卡；定时只重跑这一块，对方打卡后自动更新。"""
     st.markdown("### 最近健康打卡")
-    logs = get_recent_health_logs()
+    logs = load_when_changed("health_logs", ("health_logs",), get_recent_health_logs)
     if logs:
         st.dataframe(
             [
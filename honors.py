@@ -0,0 +1,153 @@
+"""荣誉殿堂模块 - 美好时刻和照片墙。
+
+照片存进 blobstore（按内容哈希去重，预先生成缩略图），记录里只有哈希；
+列表查询不读 photo_url 这类大字段，画廊每页只读当页的缩略图，点开才读大图。
+"""
+import streamlit as st
+from sqlalchemy import func
+
+import blobstore
+import services
+from database import HonorRecord, get_read_session
+from query_cache import cached_query
+
+HONOR_TYPES = {
+    "milestone": "🎉 纪念日",
+    "achievement": "🏆 成就",
+    "memory": "📸 回忆",
+}
+GALLERY_PAGE_SIZE = 12
+GALLERY_COLUMNS = 3
+GALLERY_THUMB = blobstore.THUMBNAIL_SIZES[0]  # 画廊格子里的缩略图
+PREVIEW_THUMB = blobstore.THUMBNAIL_SIZES[-1]  # 点开后的大图
+
+
+def create_honor(title, description, honor_type, emotion_score, created_by, photo=None) -> bool:
+    """photo 为上传的图片字节；先落盘再写记录，记录写失败只会留下一个待清理的文件。"""
+    try:
+        photo_hash = blobstore.put(photo) if photo else None
+        services.run(services.create_honor, title, description, honor_type, emotion_score, created_by, photo_hash)
+        return True
+    except Exception as e:
+        st.error(f"保存失败：{e}")
+        return False
+
+
+@cached_query("honor_records")
+def get_honors(limit=GALLERY_PAGE_SIZE, offset=0):
+    """按时间倒序分页读取荣誉记录（不含 photo_url）。"""
+    session = get_read_session()
+    try:
+        return (
+            session.query(HonorRecord)
+            .order_by(HonorRecord.created_at.desc(), HonorRecord.id.desc())
+            .limit(limit)
+            .offset(offset)
+            .all()
+        )
+    finally:
+        session.close()
+
+
+@cached_query("honor_records")
+def count_honors():
+    session = get_read_session()
+    try:
+        return session.query(func.count(HonorRecord.id)).scalar()
+    finally:
+        session.close()
+
+
+@cached_query("honor_records")
+def get_legacy_photo_url(honor_id):
+    """没迁进 blobstore 的旧图片地址（网址），只在画廊显示这一条时单独读取。"""
+    session = get_read_session()
+    try:
+        return session.query(HonorRecord.photo_url).filter(HonorRecord.id == honor_id).scalar()
+    finally:
+        session.close()
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_image(digest, size=None):
+    # 以哈希为键：内容不变哈希就不变，缓存不会过期
+    return blobstore.read(digest, size)
+
+
+def _author_display(user):
+    return "💕 我" if user == "me" else "🏸 他"
+
+
+def render_honor_form(current_user: str) -> None:
+    with st.expander("✨ 记录一个美好时刻", expanded=False):
+        with st.form("honor_form", clear_on_submit=True):
+            title = st.text_input("标题", placeholder="例如：第一次一起看比赛")
+            honor_type = st.selectbox("类型", options=list(HONOR_TYPES), format_func=lambda x: HONOR_TYPES[x])
+            description = st.text_area("描述", height=100)
+            emotion_score = st.slider("开心程度", 1.0, 10.0, 8.0, 0.5)
+            photo = st.file_uploader("照片（可选）", type=["jpg", "jpeg", "png", "webp", "gif"])
+            if st.form_submit_button("保存到荣誉殿堂", use_container_width=True):
+                if not title.strip():
+                    st.warning("请先填写标题")
+                elif create_honor(
+                    title.strip(),
+                    description.strip(),
+                    honor_type,
+                    emotion_score,
+                    current_user,
+                    photo.getvalue() if photo else None,
+                ):
+                    st.success("已保存 🏅")
+
+
+def render_honor_card(honor) -> None:
+    with st.container(border=True):
+        if honor.photo_hash:
+            try:
+                st.image(load_image(honor.photo_hash, GALLERY_THUMB), use_container_width=True)
+                if st.toggle("查看大图", key=f"honor_preview_{honor.id}"):
+                    st.image(load_image(honor.photo_hash, PREVIEW_THUMB), use_container_width=True)
+            except FileNotFoundError:
+                st.caption("🖼️ 图片文件缺失")
+        elif honor.has_legacy_photo and st.toggle("显示图片", key=f"honor_legacy_{honor.id}"):
+            # 旧记录的网址图片：点开时才读 photo_url
+            url = get_legacy_photo_url(honor.id)
+            if url:
+                st.image(url, use_container_width=True)
+            else:
+                st.caption("没有图片")
+        when = f"{honor.created_at:%Y-%m-%d}" if honor.created_at else ""
+        st.markdown(f"**{honor.title or ''}**")
+        st.caption(f"{HONOR_TYPES.get(honor.honor_type, '🏅')} · {when} · {_author_display(honor.created_by)}")
+        if honor.description:
+            st.write(honor.description)
+
+
+def render_honors() -> None:
+    """荣誉殿堂页面"""
+    st.header("🏅 荣誉殿堂")
+    current_user = st.session_state.get("user", "me")
+    render_honor_form(current_user)
+
+    total = count_honors()
+    if not total:
+        st.info("还没有荣誉记录，记下第一个美好时刻吧！")
+        return
+
+    pages = (total + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+    page = min(st.session_state.get("honor_page", 0), pages - 1)
+    honors = get_honors(limit=GALLERY_PAGE_SIZE, offset=page * GALLERY_PAGE_SIZE)
+    st.caption(f"共 {total} 条，第 {page + 1}/{pages} 页")
+
+    columns = st.columns(GALLERY_COLUMNS)
+    for i, honor in enumerate(honors):
+        with columns[i % GALLERY_COLUMNS]:
+            render_honor_card(honor)
+
+    previous_col, _, next_col = st.columns([1, 3, 1])
+    if previous_col.button("⬅️ 上一页", disabled=page == 0, use_container_width=True, key="honor_prev"):
+        st.session_state.honor_page = page - 1
+        st.rerun()
+    if next_col.button("下一页 ➡️", disabled=page + 1 >= pages, use_container_width=True, key="honor_next"):
+        st.session_state.honor_page = page + 1
+        st.rerun()
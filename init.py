@@ -5,5 +5,4 @@ from .database import (
     MatchReminder, HonorRecord, PointsLog
 )
 
-# 初始化数据库
-init_database()
\ No newline at end of file
+# 数据库在第一次调用 init_database() 时初始化（每个进程一次），导入本包不再有副作用
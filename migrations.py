@@ -0,0 +1,130 @@
+"""
+数据库迁移 - 用 PRAGMA user_version 记录版本，原地升级已有的 crush_court.db
+
+新迁移只能追加到 MIGRATIONS 末尾，已发布的迁移不要修改。
+用法：python migrations.py
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable  # apply(connection)，在迁移事务内执行
+
+
+def _backfill_points_daily(connection):
+    from database import backfill_points_daily
+
+    backfill_points_daily(connection)
+
+
+def _backfill_emotion_hourly(connection):
+    from rollups import backfill_emotion_hourly
+
+    backfill_emotion_hourly(connection)
+
+
+def _backfill_daily_summaries(connection):
+    from ai_context import backfill_daily_summaries
+
+    backfill_daily_summaries(connection)
+
+
+def _install_search_index(connection):
+    from search_index import ensure_search_index
+
+    ensure_search_index(connection)
+
+
+def _move_honor_photos(connection):
+    from blobstore import move_inline_photos
+
+    move_inline_photos(connection)
+
+
+def _add_outbox_dedupe_key(connection):
+    # 新库由 create_all 建好了这一列，旧库才需要加
+    columns = {row[1] for row in connection.exec_driver_sql("PRAGMA table_info(outbox)")}
+    if "dedupe_key" not in columns:
+        connection.exec_driver_sql("ALTER TABLE outbox ADD COLUMN dedupe_key VARCHAR")
+    connection.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_outbox_dedupe_key ON outbox (dedupe_key)")
+
+
+def _sql(*statements):
+    """把若干条 SQL 包装成迁移函数。"""
+
+    def apply(connection):
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+
+    return apply
+
+
+MIGRATIONS = [
+    Migration(1, "积分日汇总回填", _backfill_points_daily),
+    Migration(
+        2,
+        "热点查询复合索引",
+        _sql(
+            # court.get_pending_records: receiver = ? AND is_responded = 0 ORDER BY created_at DESC
+            "CREATE INDEX IF NOT EXISTS ix_love_records_pending "
+            "ON love_records (receiver, is_responded, created_at)",
+            # court.get_timeline_frame: created_at >= ? ORDER BY created_at DESC
+            "CREATE INDEX IF NOT EXISTS ix_love_records_created_at ON love_records (created_at)",
+            # points.get_recent_points_logs: user = ? AND created_at >= ? ORDER BY created_at DESC
+            "CREATE INDEX IF NOT EXISTS ix_points_log_user_created ON points_log (user, created_at)",
+            # health.get_active_reminders: is_active = 1 ORDER BY reminder_time
+            "CREATE INDEX IF NOT EXISTS ix_health_reminders_active_time "
+            "ON health_reminders (is_active, reminder_time)",
+            # health.get_recent_health_logs: ORDER BY completed_at DESC LIMIT ?
+            "CREATE INDEX IF NOT EXISTS ix_health_logs_completed_at ON health_logs (completed_at)",
+            # tasks.get_match_tasks: is_completed = 0 ORDER BY match_date
+            "CREATE INDEX IF NOT EXISTS ix_match_reminders_pending "
+            "ON match_reminders (is_completed, match_date)",
+            # tasks.get_match_tasks(show_completed=True): ORDER BY match_date
+            "CREATE INDEX IF NOT EXISTS ix_match_reminders_match_date ON match_reminders (match_date)",
+        ),
+    ),
+    Migration(3, "情绪小时汇总回填", _backfill_emotion_hourly),
+    Migration(4, "AI 上下文每日摘要回填", _backfill_daily_summaries),
+    Migration(5, "回球/荣誉全文搜索索引", _install_search_index),
+    Migration(6, "荣誉照片移入文件库", _move_honor_photos),
+    Migration(7, "发件箱去重键", _add_outbox_dedupe_key),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def run_migrations(engine) -> int:
+    """把数据库升级到最新版本，返回升级后的版本号。
+
+    每个迁移在独立的写事务（写连接以 BEGIN IMMEDIATE 开始）中执行并同时写入 user_version，
+    多个进程同时启动时只有一个会真正执行，其余的在拿到写锁后发现版本已更新而跳过。
+    """
+    with engine.connect() as connection:
+        if get_schema_version(connection) >= LATEST_VERSION:
+            return LATEST_VERSION
+
+    for migration in MIGRATIONS:
+        with engine.begin() as connection:
+            if get_schema_version(connection) < migration.version:
+                migration.apply(connection)
+                connection.exec_driver_sql(f"PRAGMA user_version = {migration.version}")
+
+    with engine.connect() as connection:
+        return get_schema_version(connection)
+
+
+if __name__ == "__main__":
+    from database import Base, get_engine
+
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    print(f"✅ 数据库版本：{run_migrations(engine)}（最新 {LATEST_VERSION}）")
@@ -0,0 +1,283 @@
+"""
+通知发件箱 - 发球、回球和到点提醒先写进 outbox 表，再由后台线程批量投递
+
+写入：services 在写业务记录的同一事务里调用 enqueue，提交成功才会有通知，回滚就一起消失；
+页面请求里从不直接发通知。
+投递：OutboxWorker 先在只读连接上看有没有到期的消息，空闲时不占写锁；有才用一个短写事务认领一批
+（把 available_at 推后一个租约时间），
+发给所有 sink 后标记已投递；失败按指数退避重试。进程在发送途中退出时租约到期会重发，
+所以是“至少一次”，接收方用消息 id 去重。
+到点提醒带去重键：每个进程都有自己的调度器，同一次提醒只会写进一条消息。
+sink 由 CRUSHCOURT_OUTBOX_SINKS 配置，逗号分隔，例如：
+    file:data/notifications.jsonl,webhook:http://127.0.0.1:8787/hook
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert
+
+from database import DATA_DIR, OutboxMessage, after_commit, get_read_session, unit_of_work
+
+BATCH_SIZE = int(os.getenv("CRUSHCOURT_OUTBOX_BATCH", "100"))
+POLL_INTERVAL = 10  # 秒；本进程的写入会立即唤醒，这个间隔只用于接手其他进程写的消息
+LEASE_SECONDS = 60  # 认领后这么久还没标记投递，就允许重新认领
+MAX_ATTEMPTS = 10  # 超过后不再重试，留在表里供排查
+BACKOFF_MAX = 300  # 秒
+RETENTION_DAYS = 7  # 已投递消息保留天数
+
+
+def enqueue(session, topic, payload, recipient=None, dedupe_key=None):
+    """在给定会话中写入一条待投递通知，不提交；提交后唤醒本进程的投递线程。
+
+    给了 dedupe_key 时用 INSERT ... ON CONFLICT DO NOTHING 写入，同一个键（保留期内）只有一条，返回 None。
+    """
+    values = dict(
+        topic=topic,
+        recipient=recipient,
+        payload=json.dumps(payload, ensure_ascii=False, default=str),
+        created_at=datetime.now(),
+        available_at=datetime.now(),
+        attempts=0,
+    )
+    message = None
+    if dedupe_key is None:
+        message = OutboxMessage(**values)
+        session.add(message)
+    else:
+        session.execute(
+            insert(OutboxMessage)
+            .values(dedupe_key=dedupe_key, **values)
+            .on_conflict_do_nothing(index_elements=[OutboxMessage.dedupe_key])
+        )
+    after_commit(session, wake_worker)
+    return message
+
+
+def _as_dict(message):
+    return {
+        "id": message.id,
+        "topic": message.topic,
+        "recipient": message.recipient,
+        "payload": json.loads(message.payload),
+        "created_at": message.created_at.isoformat(timespec="seconds"),
+    }
+
+
+class FileSink:
+    """把通知按行追加到 JSON Lines 文件。"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def send(self, messages) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lines = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages)
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def __repr__(self):
+        return f"FileSink({self.path})"
+
+
+class WebhookSink:
+    """把一批通知 POST 到一个 URL：{"messages": [...]}，非 2xx 视为失败。"""
+
+    def __init__(self, url, timeout=(3, 10)):
+        import requests
+
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def send(self, messages) -> None:
+        response = self._session.post(self.url, json={"messages": messages}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def __repr__(self):
+        return f"WebhookSink({self.url})"
+
+
+SINK_TYPES = {"file": FileSink, "webhook": WebhookSink}
+
+
+def load_sinks(spec=None):
+    """解析 CRUSHCOURT_OUTBOX_SINKS；未设置时写到数据目录下的 notifications.jsonl。"""
+    spec = os.getenv("CRUSHCOURT_OUTBOX_SINKS", "") if spec is None else spec
+    if not spec.strip():
+        return [FileSink(DATA_DIR / "notifications.jsonl")]
+    sinks = []
+    for item in spec.split(","):
+        kind, _, target = item.strip().partition(":")
+        if kind not in SINK_TYPES or not target:
+            raise ValueError(f"无法识别的通知 sink：{item}")
+        sinks.append(SINK_TYPES[kind](target))
+    return sinks
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_MAX, 2 ** attempts))
+
+
+def _due(now):
+    return (
+        OutboxMessage.delivered_at.is_(None),
+        OutboxMessage.available_at <= now,
+        OutboxMessage.attempts < MAX_ATTEMPTS,
+    )
+
+
+def has_due_messages(now=None) -> bool:
+    """只读连接上查一眼有没有到期、未投递的消息，不占写锁。"""
+    session = get_read_session()
+    try:
+        return session.query(OutboxMessage.id).filter(*_due(now or datetime.now())).first() is not None
+    finally:
+        session.close()
+
+
+def claim_batch(limit=BATCH_SIZE, now=None):
+    """认领一批到期、未投递的消息：在同一个写事务里推后 available_at 并累加 attempts。
+
+    没有到期消息时直接返回空列表，不开写事务（投递线程空闲时每次轮询都走这里）。
+    """
+    now = now or datetime.now()
+    if not has_due_messages(now):
+        return []
+    with unit_of_work() as session:
+        messages = (
+            session.query(OutboxMessage)
+            .filter(*_due(now))
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+            .all()
+        )
+        for message in messages:
+            message.attempts += 1
+            message.available_at = now + timedelta(seconds=LEASE_SECONDS)
+        return [(_as_dict(m), m.attempts) for m in messages]
+
+
+def mark_delivered(ids, now=None) -> None:
+    with unit_of_work() as session:
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(ids))
+            .values(delivered_at=now or datetime.now(), last_error=None)
+        )
+
+
+def mark_failed(claimed, error, now=None) -> None:
+    now = now or datetime.now()
+    with unit_of_work() as session:
+        for message, attempts in claimed:
+            session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == message["id"])
+                .values(available_at=now + _backoff(attempts), last_error=str(error)[:500])
+            )
+
+
+def purge_delivered(days=RETENTION_DAYS) -> int:
+    with unit_of_work() as session:
+        result = session.execute(
+            delete(OutboxMessage).where(OutboxMessage.delivered_at < datetime.now() - timedelta(days=days))
+        )
+        return result.rowcount
+
+
+def deliver_once(sinks, limit=BATCH_SIZE) -> int:
+    """认领并投递一批，返回投递成功的条数；任一 sink 失败则整批稍后重试。"""
+    claimed = claim_batch(limit)
+    if not claimed:
+        return 0
+    messages = [message for message, _ in claimed]
+    try:
+        for sink in sinks:
+            sink.send(messages)
+    except Exception as e:
+        mark_failed(claimed, f"{sink!r}: {e}")
+        return 0
+    mark_delivered([m["id"] for m in messages])
+    return len(messages)
+
+
+class OutboxWorker:
+    """后台投递线程：被唤醒或每隔 POLL_INTERVAL 秒把到期消息投递完。"""
+
+    def __init__(self, sinks, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.delivered = 0
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="crushcourt-outbox", daemon=True)
+
+    def start(self) -> "OutboxWorker":
+        self._thread.start()
+        return self
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        last_purge = None
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                while not self._stopping:
+                    count = deliver_once(self.sinks, self.batch_size)
+                    self.delivered += count
+                    if count < self.batch_size:
+                        break
+                if last_purge != datetime.now().date():
+                    purge_delivered()
+                    last_purge = datetime.now().date()
+            except Exception as e:
+                print(f"通知投递失败：{e}")
+            self._wakeup.wait(self.poll_interval)
+
+
+_worker = None
+_lock = threading.Lock()
+
+
+def start_worker(sinks=None) -> OutboxWorker:
+    """启动进程内唯一的投递线程（已启动则直接返回）。"""
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = OutboxWorker(sinks if sinks is not None else load_sinks()).start()
+    return _worker
+
+
+def wake_worker() -> None:
+    if _worker is not None:
+        _worker.wake()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import init_database
+
+    if sys.argv[1:] != ["worker"]:
+        sys.exit("用法：python outbox.py worker")
+    init_database()
+    worker = start_worker()
+    print(f"📮 通知投递中：{worker.sinks}（Ctrl+C 退出）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        worker.stop()
@@ -1,62 +1,117 @@
 """
 积分系统模块 - 记录和计算默契值
 """
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 import streamlit as st
-
-from database import PointsLog, get_session
+from sqlalchemy import case, func
+from sqlalchemy.dialects.sqlite import insert
+
+from archive import with_archived
+from change_feed import live_fragment, load_when_changed
+from database import PointsDaily, PointsLog, get_read_session
+from query_cache import cached_query
+
+# 积分汇总窗口（天），None 表示累计
+SUMMARY_WINDOWS = (7, 30, 365, None)
+
+
+def record_points(session, user, points, description, created_at=None):
+    """在给定会话中写入积分流水并累加日汇总，不提交。"""
+    created_at = created_at or datetime.now()
+    log = PointsLog(
+        user=user,
+        action="app_action",
+        points=points,
+        description=description,
+        created_at=created_at,
+    )
+    session.add(log)
+
+    stmt = insert(PointsDaily).values(user=user, day=created_at.date(), points=points, entries=1)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[PointsDaily.user, PointsDaily.day],
+            set_={
+                "points": PointsDaily.points + stmt.excluded.points,
+                "entries": PointsDaily.entries + 1,
+            },
+        )
+    )
+    return log
 
 
 def add_points(user, points, description):
     """添加积分记录。"""
-    session = get_session()
+    from services import award_points, run
+
     try:
-        log = PointsLog(
-            user=user,
-            action="app_action",
-            points=points,
-            description=description,
-            created_at=datetime.now(),
-        )
-        session.add(log)
-        session.commit()
+        run(award_points, user, points, description)
         return True
     except Exception as e:
         print(f"积分添加失败：{e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
 
 
-def get_user_points(user, days=30):
-    """获取用户最近积分。"""
-    session = get_session()
+def _window_start(days, today=None):
+    """最近 N 天（含今天）的起始日期；days=None（累计）时为 None，表示不限起点。"""
+    if days is None:
+        return None
+    today = today or date.today()
+    return today - timedelta(days=days - 1)
+
+
+@cached_query("points_daily")
+def get_points_summary(users=("me", "him"), windows=SUMMARY_WINDOWS, today=None):
+    """从日汇总表一次性算出各用户在各窗口内的积分合计。
+
+    返回 {user: {days: total}}，days 为 None 表示累计。窗口按 today（默认今天）往前数；
+    缓存只跟着 points_daily 的版本走，页面要传 today=date.today()，跨过零点后换一个缓存键。
+    """
+    columns = [PointsDaily.user]
+    for days in windows:
+        if days is None:
+            columns.append(func.coalesce(func.sum(PointsDaily.points), 0))
+        else:
+            in_window = PointsDaily.day >= _window_start(days, today)
+            columns.append(func.coalesce(func.sum(case((in_window, PointsDaily.points), else_=0)), 0))
+
+    session = get_read_session()
     try:
-        cutoff = datetime.now() - timedelta(days=days)
-        logs = (
-            session.query(PointsLog)
-            .filter(PointsLog.user == user, PointsLog.created_at >= cutoff)
-            .order_by(PointsLog.created_at.desc())
+        rows = (
+            session.query(*columns)
+            .filter(PointsDaily.user.in_(users))
+            .group_by(PointsDaily.user)
             .all()
         )
-
-        total = sum(log.points for log in logs)
-        return total, logs
     finally:
         session.close()
 
+    summary = {user: {days: 0 for days in windows} for user in users}
+    for user, *totals in rows:
+        summary[user] = dict(zip(windows, (int(t) for t in totals)))
+    return summary
 
-def get_points_ranking():
-    """获取两人积分对比。"""
-    me_total, me_logs = get_user_points("me")
-    him_total, him_logs = get_user_points("him")
 
-    return {
-        "me": {"total": me_total, "logs": me_logs},
-        "him": {"total": him_total, "logs": him_logs},
-    }
+@cached_query("points_log")
+def get_recent_points_logs(user, days=30, limit=200, today=None):
+    """获取用户最近 N 天的积分流水（用于明细展示，days=None 为全部）；范围早于归档水位时合并归档库。
+    today 的用法同 get_points_summary。"""
+    start = _window_start(days, today)
+    cutoff = datetime.combine(start, datetime.min.time()) if start else None
+
+    def load(session):
+        query = session.query(PointsLog).filter(PointsLog.user == user)
+        if cutoff is not None:
+            query = query.filter(PointsLog.created_at >= cutoff)
+        return query.order_by(PointsLog.created_at.desc()).limit(limit).all()
+
+    session = get_read_session()
+    try:
+        logs = load(session)
+    finally:
+        session.close()
+    return with_archived("points_log", cutoff, logs, load, key=lambda log: (log.created_at, log.id), limit=limit)
 
 
 def get_achievement_level(points):
@@ -75,18 +130,24 @@ def get_achievement_level(points):
 def render_points():
     """渲染积分页面。"""
     st.markdown("## 🎁 积分奖赏")
-    ranking = get_points_ranking()
+    render_points_board()
+
+
+@live_fragment
+def render_points_board():
+    """积分和积分记录；定时只重跑这一块，对方得分后自动更新。"""
+    today = date.today()
+    summary = load_when_changed("points_summary", ("points_daily",), get_points_summary, today=today)
 
-    col1, col2 = st.columns(2)
-    with col1:
-        st.metric("💕 我", ranking["me"]["total"])
-        st.caption(get_achievement_level(ranking["me"]["total"]))
-    with col2:
-        st.metric("🏸 他", ranking["him"]["total"])
-        st.caption(get_achievement_level(ranking["him"]["total"]))
+    for col, user, label in zip(st.columns(2), ("me", "him"), ("💕 我", "🏸 他")):
+        totals = summary[user]
+        with col:
+            st.metric(label, totals[30])
+            st.caption(get_achievement_level(totals[30]))
+            st.caption(f"近7天 {totals[7]} · 近一年 {totals[365]} · 累计 {totals[None]}")
 
     current_user = st.session_state.get("user", "me")
-    _, logs = get_user_points(current_user, days=30)
+    logs = load_when_changed("points_logs", ("points_log",), get_recent_points_logs, current_user, today=today)
     st.markdown("### 最近30天积分记录")
     if logs:
         st.dataframe(
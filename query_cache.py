@@ -0,0 +1,181 @@
+"""
+查询缓存 - 数据没变时，页面重跑直接复用上次的查询结果
+
+缓存键 = 函数 + 参数 + 所依赖表的版本号。写事务提交时会把写过的表在 table_versions 里更新为新的变更序号
+（见 database._bump_written_table_versions）。读取版本前先看一眼 PRAGMA data_version：
+只要有任何连接（包括其他 Streamlit 进程）提交过，它就会变化，此时才重新读版本表。
+缓存里存的是不可变快照（namedtuple / tuple / MappingProxyType），不会把 ORM 对象交给页面；
+DataFrame 存成列数组只读的副本，每次命中返回浅拷贝：增删列不影响缓存，原地改值会直接报错。
+"""
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+from sqlalchemy import inspect
+
+from database import DB_PATH
+
+CACHE_MAXSIZE = int(os.getenv("CRUSHCOURT_QUERY_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("CRUSHCOURT_QUERY_CACHE_TTL", "300"))  # 秒
+
+
+def cache_enabled() -> bool:
+    return os.getenv("CRUSHCOURT_QUERY_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class TableVersionMonitor:
+    """跟踪各表版本号；只有 data_version 变化时才查询 table_versions。"""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._data_version = None
+        self._versions = {}
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False, isolation_level=None
+            )
+        return self._connection
+
+    def versions(self, tables) -> tuple:
+        with self._lock:
+            try:
+                connection = self._connect()
+                data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    self._versions = dict(connection.execute("SELECT name, version FROM table_versions"))
+                    self._data_version = data_version
+            except sqlite3.Error:
+                # 数据库或版本表还不存在：当作全部为 0，下次再试
+                self._connection = None
+                self._data_version = None
+                self._versions = {}
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+
+_row_types = {}
+
+
+def _row_type(mapper):
+    row_type = _row_types.get(mapper)
+    if row_type is None:
+        keys = [attr.key for attr in mapper.column_attrs]
+        row_type = namedtuple(f"{mapper.class_.__name__}Row", keys)
+        _row_types[mapper] = row_type
+    return row_type
+
+
+def _is_frame(value):
+    # 不为判断类型去导入 pandas（写入路径也会导入本模块）；值是 pandas 对象时 pandas 必然已导入
+    if not type(value).__module__.startswith("pandas."):
+        return False
+    import pandas as pd
+
+    return isinstance(value, pd.DataFrame)
+
+
+def _freeze_frame(frame):
+    """复制一份列数组只读的 DataFrame；分类列冻结编码数组，其他扩展类型的列只复制，没法设为只读。"""
+    import numpy as np
+    import pandas as pd
+
+    columns = {}
+    for name, column in frame.items():
+        if isinstance(column.dtype, np.dtype):
+            values = column.to_numpy(copy=True)
+            values.flags.writeable = False
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy(copy=True)
+            codes.flags.writeable = False
+            values = pd.Categorical.from_codes(codes, dtype=column.dtype)
+        else:
+            values = column.array.copy()
+        columns[name] = values
+    return pd.DataFrame(columns, index=frame.index.copy(), copy=False)
+
+
+def snapshot(value):
+    """把查询结果转成不可变快照：ORM 对象 -> namedtuple，list -> tuple，dict -> 只读映射，DataFrame -> 只读副本。"""
+    if _is_frame(value):
+        return _freeze_frame(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(snapshot(item) for item in value)
+    if isinstance(value, dict):
+        return MappingProxyType({key: snapshot(item) for key, item in value.items()})
+    state = inspect(value, raiseerr=False)
+    if state is not None and hasattr(state, "mapper"):
+        row_type = _row_type(state.mapper)
+        return row_type(**{key: state.dict.get(key) for key in row_type._fields})
+    return value
+
+
+def _frame_view(value):
+    """缓存里的 DataFrame 给调用方一个浅拷贝：共享只读的列数组，增删列不会改到缓存里的那份。"""
+    return value.copy(deep=False) if _is_frame(value) else value
+
+
+class QueryCache:
+    """带容量上限和 TTL 的 LRU 缓存，条目在依赖表版本变化后失效。"""
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, monitor=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.monitor = monitor or TableVersionMonitor()
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (versions, expires_at, value)
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, tables, loader):
+        versions = self.monitor.versions(tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _frame_view(entry[2])
+            self.misses += 1
+
+        value = snapshot(loader())
+        with self._lock:
+            self._entries[key] = (versions, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return _frame_view(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+query_cache = QueryCache()
+
+
+def cached_query(*tables):
+    """缓存只读查询函数的结果，依赖的表任一有写入即失效。"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not cache_enabled():
+                return snapshot(fn(*args, **kwargs))
+            key = (fn.__module__, fn.__qualname__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return snapshot(fn(*args, **kwargs))
+            return query_cache.get_or_load(key, tables, lambda: fn(*args, **kwargs))
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
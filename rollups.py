@@ -0,0 +1,161 @@
+"""
+情绪小时汇总 - 热力图按 (日期, 小时, 发送者) 读预先汇总好的格子，而不是每次透视全部记录
+
+写入：services 在写 LoveRecord 的同一事务里调用 record_emotion。
+回填：python rollups.py backfill（用 love_records 和归档库里的旧记录全量重建，旧数据库升级时由迁移自动执行一次）。
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import Integer, cast, func, text
+from sqlalchemy.dialects.sqlite import insert
+
+from database import EmotionHourly, LoveRecord, bump_table_versions, get_read_session, iter_archived
+from query_cache import cached_query
+
+_BACKFILL_SQL = """
+    INSERT INTO emotion_hourly (day, hour, sender, score_sum, entries)
+    SELECT date(created_at), CAST(strftime('%H', created_at) AS INTEGER), sender,
+           SUM(COALESCE(emotion_score, 0)), COUNT(*)
+    FROM love_records
+    WHERE created_at IS NOT NULL AND sender IS NOT NULL
+    GROUP BY date(created_at), strftime('%H', created_at), sender
+"""
+
+_MERGE_SQL = """
+    INSERT INTO emotion_hourly (day, hour, sender, score_sum, entries)
+    VALUES (:day, :hour, :sender, :score_sum, :entries)
+    ON CONFLICT (day, hour, sender) DO UPDATE
+    SET score_sum = score_sum + excluded.score_sum, entries = entries + excluded.entries
+"""
+
+
+def record_emotion(session, sender, created_at, emotion_score):
+    """在给定会话中把一条记录累加进对应的小时格子，不提交。"""
+    stmt = insert(EmotionHourly).values(
+        day=created_at.date(),
+        hour=created_at.hour,
+        sender=sender,
+        score_sum=emotion_score or 0.0,
+        entries=1,
+    )
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[EmotionHourly.day, EmotionHourly.hour, EmotionHourly.sender],
+            set_={
+                "score_sum": EmotionHourly.score_sum + stmt.excluded.score_sum,
+                "entries": EmotionHourly.entries + 1,
+            },
+        )
+    )
+
+
+def backfill_emotion_hourly(connection, rebuild=False):
+    """用 love_records（含归档库）重建小时汇总；rebuild=False 时只在汇总表为空时执行。"""
+    if rebuild:
+        connection.execute(text("DELETE FROM emotion_hourly"))
+    elif connection.execute(text("SELECT 1 FROM emotion_hourly LIMIT 1")).first():
+        return
+    connection.execute(text(_BACKFILL_SQL))
+
+    table = LoveRecord.__table__
+    archived = {}
+    for _, day, hour, sender, score in iter_archived(
+        connection,
+        table,
+        [
+            func.date(table.c.created_at),
+            cast(func.strftime("%H", table.c.created_at), Integer),
+            table.c.sender,
+            table.c.emotion_score,
+        ],
+    ):
+        if day is None or sender is None:
+            continue
+        cell = archived.setdefault((day, hour, sender), [0.0, 0])
+        cell[0] += score or 0.0
+        cell[1] += 1
+    if archived:
+        connection.execute(
+            text(_MERGE_SQL),
+            [
+                {"day": day, "hour": hour, "sender": sender, "score_sum": score_sum, "entries": entries}
+                for (day, hour, sender), (score_sum, entries) in archived.items()
+            ],
+        )
+    bump_table_versions(connection, ["emotion_hourly"])
+
+
+@cached_query("emotion_hourly")
+def get_emotion_heatmap_cells(days=30, sender=None):
+    """读取最近 N 天（含今天）的小时格子，按 (day, hour) 合并两人或只取一人。"""
+    # pandas 只在读取时导入：services 的写入路径也会导入本模块
+    import pandas as pd
+
+    start = date.today() - timedelta(days=days - 1)
+    session = get_read_session()
+    try:
+        query = session.query(
+            EmotionHourly.day,
+            EmotionHourly.hour,
+            EmotionHourly.score_sum,
+            EmotionHourly.entries,
+        ).filter(EmotionHourly.day >= start)
+        if sender is not None:
+            query = query.filter(EmotionHourly.sender == sender)
+        rows = query.all()
+    finally:
+        session.close()
+
+    cells = pd.DataFrame(rows, columns=["day", "hour", "score_sum", "entries"])
+    return cells.groupby(["day", "hour"], as_index=False)[["score_sum", "entries"]].sum()
+
+
+@cached_query("emotion_hourly")
+def get_timeline_rollup_frame(days=90):
+    """最近 N 天的小时格子，整理成与 court.get_timeline_frame 同样的列，供长时间范围的时间线使用。"""
+    import pandas as pd
+
+    start = date.today() - timedelta(days=days - 1)
+    session = get_read_session()
+    try:
+        rows = (
+            session.query(
+                EmotionHourly.day,
+                EmotionHourly.hour,
+                EmotionHourly.sender,
+                EmotionHourly.score_sum,
+                EmotionHourly.entries,
+            )
+            .filter(EmotionHourly.day >= start)
+            .all()
+        )
+    finally:
+        session.close()
+
+    cells = pd.DataFrame(rows, columns=["day", "hour", "sender", "score_sum", "entries"])
+    preview = cells["entries"].astype(str) + "条·小时均值"
+    return pd.DataFrame(
+        {
+            "created_at": pd.to_datetime(cells["day"]) + pd.to_timedelta(cells["hour"], unit="h"),
+            "sender": cells["sender"],
+            "action": None,
+            "emotion_score": (cells["score_sum"] / cells["entries"]).round(1),
+            "preview": preview,
+            "content_length": preview.str.len(),
+            "entries": cells["entries"].astype("int64"),
+        }
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import get_engine, init_database
+
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("用法：python rollups.py backfill")
+    init_database()
+    with get_engine().begin() as connection:
+        backfill_emotion_hourly(connection, rebuild=True)
+        cells = connection.execute(text("SELECT COUNT(*) FROM emotion_hourly")).scalar()
+    print(f"✅ 情绪小时汇总已重建：{cells} 个格子")
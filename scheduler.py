@@ -0,0 +1,230 @@
+"""
+提醒调度器 - 进程内一个后台线程，用最小堆按下次触发时间排队，睡到最早的一条到点
+
+启动时各查一次启用的健康提醒和未完成的赛事，之后只靠增量更新：
+services 在新建/停用健康提醒、新建/完成赛事的事务提交后通知调度器（见 database.after_commit），
+不按固定间隔轮询数据表。健康提醒每天 HH:MM 触发一次，赛事提醒在 reminder_time 触发一次；
+启动时比赛还没开始、提醒时间已过（停机期间错过）的赛事立即补一次提醒。
+每个进程各有一个调度器，同一次提醒会在每个进程里都触发，写发件箱时按去重键只留一条（见 services.notify_reminder_due）。
+触发的提醒放进最近触发记录，页面重跑时取出来提示；也可以用 add_listener 订阅。
+"""
+import heapq
+import itertools
+import threading
+from collections import deque
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+
+from database import HealthReminder, MatchReminder, get_read_session
+
+FIRED_HISTORY = 200  # 保留的最近触发记录条数
+MAX_SLEEP = 300  # 秒；最长睡这么久就醒来重新计算，防止系统时间被调整后睡过头
+
+
+@dataclass(frozen=True)
+class DueReminder:
+    kind: str  # 'health' 或 'match'
+    reminder_id: int
+    title: str  # 健康提醒为提醒类型，赛事提醒为赛事名称
+    message: str
+    due_at: datetime  # 计划触发时间；赛事提醒补发时仍是原来的 reminder_time，用于去重
+
+
+def next_daily_fire(reminder_time: str, now: datetime) -> datetime:
+    """“HH:MM” 在 now 之后的下一次时间：今天还没到就是今天，否则是明天。"""
+    hour, minute = (int(part) for part in reminder_time.split(":", 1))
+    fire_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return fire_at if fire_at > now else fire_at + timedelta(days=1)
+
+
+class ReminderScheduler:
+    """最小堆 + 条件变量的单线程调度器。
+
+    堆里的过期条目不删除（取消或改期时只更新 _entries），弹出时和 _entries 对不上就跳过。
+    """
+
+    def __init__(self, clock=datetime.now):
+        self.clock = clock
+        self._heap = []  # (fire_at, seq, key)
+        self._entries = {}  # key -> (fire_at, seq, reminder)
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._fired = deque(maxlen=FIRED_HISTORY)  # (序号, DueReminder)
+        self._fired_count = 0
+        self._listeners = []
+        self._thread = None
+        self._stopping = False
+
+    # ---- 生命周期 ----
+
+    def start(self) -> "ReminderScheduler":
+        self.load()
+        self._thread = threading.Thread(target=self._run, name="crushcourt-reminders", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def load(self) -> None:
+        """从数据库读入所有启用的健康提醒和还没开赛、未完成的赛事（提醒时间已过的立即触发）。"""
+        now = self.clock()
+        session = get_read_session()
+        try:
+            health = session.query(HealthReminder).filter(HealthReminder.is_active.is_(True)).all()
+            matches = (
+                session.query(MatchReminder)
+                .filter(MatchReminder.is_completed.is_(False), MatchReminder.match_date > now)
+                .all()
+            )
+        finally:
+            session.close()
+        for reminder in health:
+            self.schedule_health(reminder)
+        for match in matches:
+            self.schedule_match(match)
+
+    # ---- 增量更新 ----
+
+    def schedule_health(self, reminder) -> None:
+        if not reminder.is_active or not reminder.reminder_time:
+            self.cancel("health", reminder.id)
+            return
+        try:
+            fire_at = next_daily_fire(reminder.reminder_time, self.clock())
+        except ValueError:
+            return  # 时间格式不对的旧数据，不调度
+        due = DueReminder("health", reminder.id, reminder.reminder_type, reminder.message or "", fire_at)
+        self._push(("health", reminder.id), fire_at, due)
+
+    def schedule_match(self, match) -> None:
+        now = self.clock()
+        if match.is_completed or match.reminder_time is None or (match.match_date and match.match_date <= now):
+            self.cancel("match", match.id)
+            return
+        # 离比赛不到提醒提前量时才创建的赛事，立即提醒
+        fire_at = max(match.reminder_time, now)
+        message = f"{match.match_date:%m-%d %H:%M} · {match.location or '地点待定'}"
+        due = DueReminder("match", match.id, match.title, message, match.reminder_time)
+        self._push(("match", match.id), fire_at, due)
+
+    def cancel(self, kind: str, reminder_id: int) -> None:
+        with self._condition:
+            self._entries.pop((kind, reminder_id), None)
+
+    def _push(self, key, fire_at, reminder) -> None:
+        with self._condition:
+            seq = next(self._seq)
+            self._entries[key] = (fire_at, seq, reminder)
+            heapq.heappush(self._heap, (fire_at, seq, key))
+            if self._heap[0][1] == seq:
+                # 新条目成了最早的一条，叫醒调度线程重新计算睡眠时间
+                self._condition.notify()
+
+    # ---- 调度线程 ----
+
+    def next_due(self):
+        """最早一条的 (触发时间, 提醒)，没有时返回 None。"""
+        with self._condition:
+            self._drop_stale()
+            if not self._heap:
+                return None
+            fire_at, _, key = self._heap[0]
+            return fire_at, self._entries[key][2]
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            fire_at, seq, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == seq:
+                return
+            heapq.heappop(self._heap)
+
+    def _pop_due(self):
+        """在锁内弹出所有已到点的提醒；健康提醒同时排上第二天的。"""
+        now = self.clock()
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, key = heapq.heappop(self._heap)
+            _, _, reminder = self._entries.pop(key)
+            due.append(reminder)
+            if reminder.kind == "health":
+                fire_at = reminder.due_at + timedelta(days=1)
+                while fire_at <= now:  # 休眠或停机错过了好几天时只补一次
+                    fire_at += timedelta(days=1)
+                seq = next(self._seq)
+                self._entries[key] = (fire_at, seq, replace(reminder, due_at=fire_at))
+                heapq.heappush(self._heap, (fire_at, seq, key))
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    due = self._pop_due()
+                    if due:
+                        break
+                    timeout = MAX_SLEEP
+                    if self._heap:
+                        timeout = min(MAX_SLEEP, (self._heap[0][0] - self.clock()).total_seconds())
+                    self._condition.wait(max(timeout, 0))
+                if self._stopping:
+                    return
+                for reminder in due:
+                    self._fired_count += 1
+                    self._fired.append((self._fired_count, reminder))
+                listeners = list(self._listeners)
+
+            for reminder in due:
+                for listener in listeners:
+                    try:
+                        listener(reminder)
+                    except Exception as e:
+                        print(f"提醒回调失败：{e}")
+
+    # ---- 读取触发结果 ----
+
+    def add_listener(self, listener) -> None:
+        """listener(DueReminder) 在调度线程里调用，应尽快返回。"""
+        with self._condition:
+            self._listeners.append(listener)
+
+    def fired_since(self, cursor: int = 0):
+        """返回序号大于 cursor 的触发记录和最新序号，供页面按会话各自取新提醒。"""
+        with self._condition:
+            return [reminder for number, reminder in self._fired if number > cursor], self._fired_count
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+def start_scheduler() -> ReminderScheduler:
+    """启动进程内唯一的调度器（已启动则直接返回）。"""
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = ReminderScheduler().start()
+    return _scheduler
+
+
+def get_scheduler():
+    """已启动的调度器；本进程没有启动时返回 None（命令行脚本等）。"""
+    return _scheduler
+
+
+def notify_health_reminder(reminder) -> None:
+    if _scheduler is not None:
+        _scheduler.schedule_health(reminder)
+
+
+def notify_match(match) -> None:
+    if _scheduler is not None:
+        _scheduler.schedule_match(match)
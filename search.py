@@ -0,0 +1,274 @@
+"""
+全文搜索 - 在回球记录内容和荣誉记录（标题、描述）里找旧消息，比如“什么时候聊过杭州的比赛”
+
+索引：每张表一个 FTS5 外部内容表（{表名}_fts，不重复存正文），由触发器在增删改时同步（见 search_index.py）；
+分词用 trigram，中文不需要分词词典，任意连续 3 个字以上的片段都能走索引。
+旧数据库升级时由迁移建索引并从已有数据重建一次；归档库里的回球记录有自己的一份索引。
+查询：空格分隔的词都要出现。3 个字以上的词走 MATCH，按 bm25 排序，用 snippet 截取命中片段；
+只有 1~2 个字的词时 trigram 用不上索引，退化为 LIKE 扫描，按时间倒序。
+重建：python search.py rebuild（主库和归档库）；命令行试查：python search.py query 杭州 比赛
+"""
+import html
+import json
+import re
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import streamlit as st
+from sqlalchemy import text
+
+from archive import archived_before
+from database import (
+    ARCHIVE_PATH,
+    bump_table_versions,
+    get_archive_engine,
+    get_archive_read_session,
+    get_engine,
+    get_read_session,
+)
+from query_cache import cached_query
+from search_index import SEARCH_TABLES, ensure_search_index
+# 结果类型 -> (表, 时间列, 作者列, 标题列)，r 是源表的别名
+KINDS = {
+    "ball": ("love_records", "r.created_at", "r.sender", "NULL"),
+    "honor": ("honor_records", "r.created_at", "r.created_by", "r.title"),
+}
+KIND_LABELS = {"ball": "🏸 回球", "honor": "🏅 荣誉"}
+MIN_TERM_CHARS = 3  # trigram 能走索引的最短长度
+PAGE_SIZE = 10
+SNIPPET_TOKENS = 24  # snippet 截取的 token 数（trigram 下约等于字数）
+SNIPPET_CHARS = 40  # 只有短词时在 Python 里截取的字数
+# 命中片段的标记，渲染时再转成 <mark>，避免和正文里的 HTML/Markdown 混在一起
+HIGHLIGHT_OPEN = "\x02"
+HIGHLIGHT_CLOSE = "\x03"
+
+
+def _parse(query):
+    """拆成 (MATCH 表达式, 短词列表)；每个长词作为一个短语，引号按 FTS5 规则转义。"""
+    terms = query.split()
+    long_terms = [term for term in terms if len(term) >= MIN_TERM_CHARS]
+    short_terms = [term for term in terms if len(term) < MIN_TERM_CHARS]
+    match = " ".join('"' + term.replace('"', '""') + '"' for term in long_terms)
+    return match, short_terms
+
+
+def _like(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _mark(snippet, terms):
+    if not terms:
+        return snippet
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    return pattern.sub(lambda m: HIGHLIGHT_OPEN + m.group(0) + HIGHLIGHT_CLOSE, snippet)
+
+
+def _excerpt(body, terms, width=SNIPPET_CHARS):
+    """截取第一个命中词附近的一段。"""
+    lowered = body.lower()
+    positions = [p for p in (lowered.find(term.lower()) for term in terms) if p >= 0]
+    start = max(0, min(positions, default=0) - width // 3)
+    excerpt = body[start:start + width]
+    return ("…" if start > 0 else "") + excerpt + ("…" if start + width < len(body) else "")
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    kind: str  # 'ball' 回球记录 / 'honor' 荣誉记录
+    id: int
+    created_at: Optional[datetime]
+    author: Optional[str]
+    title: Optional[str]
+    snippet: str  # 命中处用 HIGHLIGHT_OPEN / HIGHLIGHT_CLOSE 包起来
+    score: Optional[float]  # bm25，越小越相关；只有短词时为 None
+
+
+def _search_source(session, kind, match, short_terms, limit, exclude=()):
+    """在一个数据库的一张表里搜索，返回 (前 limit 条命中, 命中总数)；exclude 里的 id 不算。"""
+    table, created_at, author, title = KINDS[kind]
+    fts = f"{table}_fts"
+    columns = SEARCH_TABLES[table]
+    conditions, params = [], {"limit": limit, "open": HIGHLIGHT_OPEN, "close": HIGHLIGHT_CLOSE}
+    if match:
+        conditions.append(f"{fts} MATCH :match")
+        params["match"] = match
+    for i, term in enumerate(short_terms):
+        conditions.append("(" + " OR ".join(f"{fts}.{c} LIKE :s{i} ESCAPE '\\'" for c in columns) + ")")
+        params[f"s{i}"] = _like(term)
+    if exclude:
+        conditions.append(f"{fts}.rowid NOT IN (SELECT value FROM json_each(:exclude))")
+        params["exclude"] = json.dumps(list(exclude))
+    where = " AND ".join(conditions)
+
+    if match:
+        body = f"snippet({fts}, -1, :open, :close, '…', {SNIPPET_TOKENS}), bm25({fts})"
+        order = f"{fts}.rank"
+    else:
+        body = " || ' ' || ".join(f"COALESCE({fts}.{c}, '')" for c in columns) + ", NULL"
+        order = f"{created_at} DESC"
+    rows = session.execute(
+        text(
+            f"SELECT {fts}.rowid, {created_at}, {author}, {title}, {body} "
+            f"FROM {fts} JOIN {table} r ON r.id = {fts}.rowid WHERE {where} ORDER BY {order} LIMIT :limit"
+        ),
+        params,
+    ).all()
+    total = session.execute(text(f"SELECT COUNT(*) FROM {fts} WHERE {where}"), params).scalar()
+
+    hits = []
+    for rowid, created, who, heading, snippet, score in rows:
+        snippet = snippet if match else _excerpt(snippet.strip(), short_terms)
+        hits.append(
+            SearchHit(
+                kind=kind,
+                id=rowid,
+                created_at=datetime.fromisoformat(created) if created else None,
+                author=who,
+                title=heading,
+                snippet=_mark(snippet, short_terms),
+                score=score,
+            )
+        )
+    return hits, total
+
+
+def _has_index(session, table):
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": f"{table}_fts"}
+    ).first() is not None
+
+
+def _hot_ball_ids(archive_session):
+    """主库里 id 不大于归档库最大 id 的回球（未回应的旧记录，和归档中途中断时两边都有的那批）。"""
+    max_id = archive_session.execute(text("SELECT MAX(id) FROM love_records")).scalar()
+    if max_id is None:
+        return []
+    session = get_read_session()
+    try:
+        rows = session.execute(text("SELECT id FROM love_records WHERE id <= :max_id"), {"max_id": max_id})
+        return rows.scalars().all()
+    finally:
+        session.close()
+
+
+@cached_query("love_records", "honor_records")
+def search(query, kinds=tuple(KINDS), page=0, page_size=PAGE_SIZE):
+    """搜索回球和荣誉记录，返回 (本页命中, 命中总数)；回球记录已归档时连归档库一起搜。"""
+    match, short_terms = _parse(query)
+    if not match and not short_terms:
+        return (), 0
+    fetch = (page + 1) * page_size
+
+    sources = [(kind, get_read_session, False) for kind in kinds]
+    if "ball" in kinds and archived_before("love_records") is not None:
+        sources.append(("ball", get_archive_read_session, True))
+    hits, total = [], 0
+    for kind, open_session, archived in sources:
+        session = open_session()
+        try:
+            if not _has_index(session, KINDS[kind][0]):
+                continue
+            # 归档中途中断时同一条可能两边都有，主库优先：归档库的命中和总数都不算主库里也有的 id
+            exclude = _hot_ball_ids(session) if archived else ()
+            source_hits, source_total = _search_source(session, kind, match, short_terms, fetch, exclude)
+        finally:
+            session.close()
+        hits.extend(source_hits)
+        total += source_total
+
+    if match:
+        hits.sort(key=lambda hit: hit.score)
+    else:
+        hits.sort(key=lambda hit: hit.created_at or datetime.min, reverse=True)
+    return tuple(hits[page * page_size:fetch]), total
+
+
+def highlight_html(snippet):
+    """把命中标记转成 <mark>，其余内容转义。"""
+    escaped = html.escape(snippet.replace("\n", " "))
+    return escaped.replace(HIGHLIGHT_OPEN, "<mark>").replace(HIGHLIGHT_CLOSE, "</mark>")
+
+
+def _author_display(author):
+    return {"me": "💕 我", "him": "🏸 他"}.get(author, author or "")
+
+
+def render_search():
+    """搜索页"""
+    st.header("🔍 搜索")
+    query = st.text_input(
+        "搜索内容",
+        placeholder="例如：杭州 比赛",
+        key="search_query",
+        help="空格分隔的词都要出现；3 个字以上的词按相关度排序，只有 1~2 个字时按时间排序",
+    )
+    scope = st.radio(
+        "范围",
+        options=["all", *KINDS],
+        format_func=lambda x: "全部" if x == "all" else KIND_LABELS[x],
+        horizontal=True,
+        key="search_scope",
+        label_visibility="collapsed",
+    )
+    if not query.strip():
+        st.caption("在回球记录和荣誉记录里找旧消息")
+        return
+
+    kinds = tuple(KINDS) if scope == "all" else (scope,)
+    # 换了关键词或范围就回到第一页
+    if st.session_state.get("search_key") != (query, kinds):
+        st.session_state.search_key = (query, kinds)
+        st.session_state.search_page = 0
+    page = st.session_state.search_page
+
+    hits, total = search(query.strip(), kinds, page)
+    if not total:
+        st.info("没有找到相关记录")
+        return
+
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    st.caption(f"共 {total} 条，第 {page + 1}/{pages} 页")
+    for hit in hits:
+        when = f"{hit.created_at:%Y-%m-%d %H:%M}" if hit.created_at else ""
+        heading = f" · **{hit.title}**" if hit.title else ""
+        st.markdown(f"{KIND_LABELS[hit.kind]} · {when} · {_author_display(hit.author)}{heading}")
+        st.markdown(f"> {highlight_html(hit.snippet)}", unsafe_allow_html=True)
+
+    previous_col, _, next_col = st.columns([1, 3, 1])
+    if previous_col.button("⬅️ 上一页", disabled=page == 0, use_container_width=True):
+        st.session_state.search_page = page - 1
+        st.rerun()
+    if next_col.button("下一页 ➡️", disabled=page + 1 >= pages, use_container_width=True):
+        st.session_state.search_page = page + 1
+        st.rerun()
+
+
+def main():
+    from database import init_database
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild":
+        init_database()
+        with get_engine().begin() as connection:
+            rebuilt = ensure_search_index(connection, rebuild=True)
+            bump_table_versions(connection, rebuilt)
+        print(f"✅ 主库索引已重建：{', '.join(rebuilt)}")
+        if ARCHIVE_PATH.exists():
+            with get_archive_engine().begin() as connection:
+                rebuilt = ensure_search_index(connection, rebuild=True)
+            print(f"✅ 归档库索引已重建：{', '.join(rebuilt)}")
+    elif command == "query" and len(sys.argv) > 2:
+        init_database()
+        hits, total = search.uncached(" ".join(sys.argv[2:]), page_size=20)
+        print(f"共 {total} 条")
+        for hit in hits:
+            snippet = hit.snippet.replace(HIGHLIGHT_OPEN, "【").replace(HIGHLIGHT_CLOSE, "】")
+            print(f"  [{hit.kind} #{hit.id}] {hit.created_at or ''} {snippet}")
+    else:
+        sys.exit("用法：python search.py rebuild | python search.py query 关键词 ...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+全文索引 - 回球记录和荣誉记录的 FTS5 外部内容表及同步触发器（查询和页面见 search.py）
+
+每张表一个 {表名}_fts，不重复存正文，由触发器在增删改时同步；分词用 trigram。
+这里不依赖 streamlit，迁移和归档任务建索引时只导入本模块。
+"""
+from sqlalchemy import text
+
+# 表 -> 建索引的列
+SEARCH_TABLES = {
+    "love_records": ("content",),
+    "honor_records": ("title", "description"),
+}
+
+
+def _index_ddl(table, columns):
+    fts = f"{table}_fts"
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert_new = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{names}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {table} BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def _existing_tables(connection):
+    return {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+
+def ensure_search_index(connection, rebuild=False):
+    """给连接所在数据库里已有的表建索引和触发器；新建的索引（或 rebuild=True 时全部）从表数据重建。
+
+    返回重建过的表名列表。主库上由调用方负责更新表版本号（归档库没有版本表）。
+    """
+    existing = _existing_tables(connection)
+    rebuilt = []
+    for table, columns in SEARCH_TABLES.items():
+        if table not in existing:
+            continue
+        created = f"{table}_fts" not in existing
+        for statement in _index_ddl(table, columns):
+            connection.exec_driver_sql(statement)
+        if created or rebuild:
+            connection.exec_driver_sql(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+            rebuilt.append(table)
+    return rebuilt
@@ -0,0 +1,240 @@
+"""
+业务写入层 - 每个业务动作连同它的积分奖励在同一个会话里完成
+
+这里的函数只往传入的 session 里写数据、不提交，由 submit / run / run_batch 统一提交，
+页面模块负责把异常转成提示。
+"""
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from ai_context import summarize_health_log, summarize_love_record, summarize_match
+from database import HealthLog, HealthReminder, HonorRecord, LoveRecord, MatchReminder, after_commit, unit_of_work
+from outbox import enqueue
+from points import record_points
+from rollups import record_emotion
+from scheduler import notify_health_reminder, notify_match
+from writer import get_write_queue, write_queue_enabled
+
+# 等待后台写线程返回结果的最长秒数
+WRITE_TIMEOUT = 30
+
+# 各动作奖励的积分
+SERVE_POINTS = 5
+RETURN_POINTS = 3
+HEALTH_CHECKIN_POINTS = 2
+MATCH_COMPLETE_POINTS = 8
+
+
+def _user_display(user):
+    return "💕 我" if user == "me" else "🏸 他"
+
+
+def _ball_payload(record):
+    return {
+        "record_id": record.id,
+        "sender": record.sender,
+        "action": record.action,
+        "record_type": record.record_type,
+        "preview": (record.content or "")[:50],
+        "emotion_score": record.emotion_score,
+        "created_at": record.created_at,
+    }
+
+
+def serve_ball(session, sender, receiver, record_type, action, content, emotion_score=5.0):
+    """发一球并通知对方；发球（serve）额外奖励积分。"""
+    record = LoveRecord(
+        sender=sender,
+        receiver=receiver,
+        record_type=record_type,
+        action=action,
+        content=content,
+        emotion_score=emotion_score,
+        created_at=datetime.now(),
+    )
+    session.add(record)
+    session.flush()  # 通知里要带记录 id
+    record_emotion(session, sender, record.created_at, emotion_score)
+    summarize_love_record(session, record)
+    enqueue(session, "ball.served", _ball_payload(record), recipient=receiver)
+
+    if action == "serve":
+        record_points(session, sender, SERVE_POINTS, f"发布新动态：{content[:20]}...")
+    return record
+
+
+def return_ball(session, record_id, responder, response_action, response_content):
+    """回应一条记录：标记原记录已回应，写入回球、通知对方并奖励积分。记录不存在时返回 None。"""
+    record = session.get(LoveRecord, record_id)
+    if record is None:
+        return None
+
+    now = datetime.now()
+    record.is_read = True
+    record.is_responded = True
+    record.responded_at = now
+
+    response = LoveRecord(
+        sender=responder,
+        receiver=record.sender,
+        record_type=record.record_type,
+        action=response_action,
+        content=response_content,
+        emotion_score=record.emotion_score,  # 继承情绪分数
+        created_at=now,
+        is_read=False,
+    )
+    session.add(response)
+    session.flush()
+    record_emotion(session, responder, now, response.emotion_score)
+    summarize_love_record(session, response)
+    enqueue(session, "ball.returned", {**_ball_payload(response), "reply_to": record.id}, recipient=record.sender)
+
+    record_points(session, responder, RETURN_POINTS, f"回应了{_user_display(record.sender)}")
+    return response
+
+
+def award_points(session, user, points, description):
+    """单独奖励积分（points.add_points 使用）。"""
+    return record_points(session, user, points, description)
+
+
+def create_health_reminder(session, reminder_type, reminder_time, message, set_by):
+    reminder = HealthReminder(
+        reminder_type=reminder_type,
+        reminder_time=reminder_time,
+        message=message,
+        set_by=set_by,
+        is_active=True,
+        created_at=datetime.now(),
+    )
+    session.add(reminder)
+    after_commit(session, lambda: notify_health_reminder(reminder))
+    return reminder
+
+
+def deactivate_health_reminder(session, reminder_id):
+    """停用健康提醒，之后不再触发。提醒不存在时返回 None。"""
+    reminder = session.get(HealthReminder, reminder_id)
+    if reminder is None:
+        return None
+    reminder.is_active = False
+    after_commit(session, lambda: notify_health_reminder(reminder))
+    return reminder
+
+
+def check_in_health(session, reminder_id, user, note=""):
+    """健康打卡并奖励积分。"""
+    log = HealthLog(
+        reminder_id=reminder_id,
+        user=user,
+        completed_at=datetime.now(),
+        note=note or None,
+    )
+    session.add(log)
+    summarize_health_log(session, log)
+    record_points(session, user, HEALTH_CHECKIN_POINTS, "完成健康打卡")
+    return log
+
+
+def create_match(session, title, opponent, match_date, location, created_by):
+    reminder = MatchReminder(
+        title=title,
+        opponent=opponent,
+        match_date=match_date,
+        location=location,
+        reminder_time=match_date - timedelta(hours=2),
+        is_completed=False,
+        created_by=created_by,
+        created_at=datetime.now(),
+    )
+    session.add(reminder)
+    summarize_match(session, reminder)
+    after_commit(session, lambda: notify_match(reminder))
+    return reminder
+
+
+def complete_match(session, task_id, user):
+    """标记赛事完成并奖励积分。任务不存在时返回 None。"""
+    task = session.get(MatchReminder, task_id)
+    if task is None:
+        return None
+    task.is_completed = True
+    summarize_match(session, task, completed=True)
+    after_commit(session, lambda: notify_match(task))
+    record_points(session, user, MATCH_COMPLETE_POINTS, f"完成赛事任务：{task.title}")
+    return task
+
+
+def create_honor(session, title, description, honor_type, emotion_score, created_by, photo_hash=None):
+    """记录一个荣誉时刻；照片已由调用方存进 blobstore，这里只记哈希。"""
+    honor = HonorRecord(
+        title=title,
+        description=description,
+        honor_type=honor_type,
+        photo_hash=photo_hash,
+        emotion_score=emotion_score,
+        created_by=created_by,
+        created_at=datetime.now(),
+    )
+    session.add(honor)
+    return honor
+
+
+def notify_reminder_due(session, reminder):
+    """提醒到点：写一条发给两人的通知（scheduler 触发时调用）。
+
+    每个进程的调度器都会触发同一次提醒，按 (类型, 提醒 id, 计划时间) 去重，只写一条。
+    """
+    return enqueue(
+        session,
+        "reminder.due",
+        {
+            "kind": reminder.kind,
+            "reminder_id": reminder.reminder_id,
+            "title": reminder.title,
+            "message": reminder.message,
+            "due_at": reminder.due_at,
+        },
+        dedupe_key=f"reminder:{reminder.kind}:{reminder.reminder_id}:{reminder.due_at:%Y-%m-%dT%H:%M}",
+    )
+
+
+def submit(action, *args, **kwargs) -> Future:
+    """提交一个业务动作，返回 Future。
+
+    开启写入队列时交给后台写线程与其他请求合并提交，否则立即在当前线程提交。
+    """
+    if write_queue_enabled():
+        return get_write_queue().submit(action, *args, **kwargs)
+
+    future = Future()
+    try:
+        with unit_of_work() as session:
+            result = action(session, *args, **kwargs)
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+    return future
+
+
+def run(action, *args, **kwargs):
+    """执行单个业务动作并等待提交完成，返回动作的结果。"""
+    return submit(action, *args, **kwargs).result(timeout=WRITE_TIMEOUT)
+
+
+def run_batch(calls):
+    """在一个事务里执行多个业务动作，任一失败则全部回滚。
+
+    calls 为 (action, args, kwargs) 或 (action, args) 的序列，返回各动作结果的列表。
+    """
+    return run(_run_calls, list(calls))
+
+
+def _run_calls(session, calls):
+    results = []
+    for call in calls:
+        action, args, kwargs = (*call, {}) if len(call) == 2 else call
+        results.append(action(session, *args, **kwargs))
+    return results
@@ -2,16 +2,25 @@
 CrushCourt - 你们的专属爱情球场 🏸❤️
 双人互动恋爱App，让日常记录变成一场有趣的羽毛球游戏
 """
+import importlib
 import os
+from functools import lru_cache
 from pathlib import Path
 
 import streamlit as st
 
-from court import render_court
-from database import init_database
-from health import render_health
-from points import render_points
-from tasks import render_tasks
+from change_feed import live_fragment
+from database import get_engine, init_database
+
+# 菜单 -> (模块, 渲染函数)。页面模块及其依赖（pandas、plotly、requests 等）在第一次打开该页时才导入
+PAGES = {
+    "🏸 双人球场": ("court", "render_court"),
+    "💧 健康管理": ("health", "render_health"),
+    "🏆 赛事任务": ("tasks", "render_tasks"),
+    "🏅 荣誉殿堂": ("honors", "render_honors"),
+    "🎁 积分奖赏": ("points", "render_points"),
+    "🔍 搜索": ("search", "render_search"),
+}
 
 
 st.set_page_config(
@@ -22,17 +31,20 @@ st.set_page_config(
 )
 
 
+@lru_cache(maxsize=4)
+def _read_css(path: Path, mtime: float) -> str:
+    # 以修改时间为键：文件不变时每次重跑都直接用内存里的内容
+    return path.read_text(encoding="utf-8")
+
+
 def load_css() -> None:
     """加载自定义CSS。"""
     css_path = Path(__file__).with_name("style.css")
-    if css_path.exists():
-        st.markdown(f"<style>{css_path.read_text(encoding='utf-8')}</style>", unsafe_allow_html=True)
-
-
-def render_honors() -> None:
-    """荣誉模块占位。"""
-    st.header("🏅 荣誉殿堂")
-    st.info("该模块正在建设中，可先使用双人球场/健康/赛事/积分功能。")
+    try:
+        css = _read_css(css_path, css_path.stat().st_mtime)
+    except FileNotFoundError:
+        return
+    st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
 
 
 def get_user_passwords() -> dict:
@@ -55,7 +67,28 @@ def get_user_passwords() -> dict:
     return default_pw
 
 
-init_database()
+@st.cache_resource(show_spinner=False)
+def bootstrap_database():
+    """建表和迁移每个进程只做一次；之后的重跑直接命中缓存。"""
+    init_database()
+    return get_engine()
+
+
+@st.cache_resource(show_spinner=False)
+def bootstrap_scheduler():
+    """提醒调度线程和通知投递线程每个进程只启动一个；提醒到点时写入发件箱，不在页面请求里发通知。
+    登录后才第一次调用：登录页不导入 services、outbox、scheduler 这些业务模块。"""
+    import services
+    from outbox import start_worker
+    from scheduler import start_scheduler
+
+    start_worker()
+    reminder_scheduler = start_scheduler()
+    reminder_scheduler.add_listener(lambda reminder: services.submit(services.notify_reminder_due, reminder))
+    return reminder_scheduler
+
+
+bootstrap_database()
 
 if "user" not in st.session_state:
     st.session_state.user = None
@@ -98,7 +131,31 @@ def login() -> None:
         st.markdown("</div>", unsafe_allow_html=True)
 
 
+def render_page(menu: str) -> None:
+    """按需导入页面模块并渲染；已导入的模块由 importlib 直接从 sys.modules 返回。"""
+    module_name, func_name = PAGES[menu]
+    getattr(importlib.import_module(module_name), func_name)()
+
+
+@live_fragment
+def show_due_reminders() -> None:
+    """把上次检查之后触发的提醒用 toast 提示出来（定时自检，不必等页面重跑）；刚登录时不补发之前的。"""
+    cursor = st.session_state.get("reminder_cursor")
+    due, latest = bootstrap_scheduler().fired_since(cursor or 0)
+    st.session_state.reminder_cursor = latest
+    if cursor is None:
+        return
+    for reminder in due:
+        if reminder.kind == "health":
+            from health import REMINDER_TYPES
+
+            st.toast(f"{REMINDER_TYPES.get(reminder.title, '⏰ 提醒')}：{reminder.message}", icon="⏰")
+        else:
+            st.toast(f"赛事提醒：{reminder.title}（{reminder.message}）", icon="🏸")
+
+
 def main() -> None:
+    bootstrap_scheduler()
     with st.sidebar:
         st.markdown(
             f"""
@@ -110,27 +167,15 @@ def main() -> None:
             unsafe_allow_html=True,
         )
 
-        menu = st.radio(
-            "导航",
-            ["🏸 双人球场", "💧 健康管理", "🏆 赛事任务", "🏅 荣誉殿堂", "🎁 积分奖赏"],
-            label_visibility="collapsed",
-        )
+        menu = st.radio("导航", list(PAGES), label_visibility="collapsed")
 
         if st.button("🚪 退出登录", use_container_width=True):
             st.session_state.user = None
             st.session_state.authenticated = False
             st.rerun()
 
-    if menu == "🏸 双人球场":
-        render_court()
-    elif menu == "💧 健康管理":
-        render_health()
-    elif menu == "🏆 赛事任务":
-        render_tasks()
-    elif menu == "🏅 荣誉殿堂":
-        render_honors()
-    elif menu == "🎁 积分奖赏":
-        render_points()
+    show_due_reminders()
+    render_page(menu)
 
 
 load_css()
@@ -3,37 +3,26 @@ from datetime import datetime, timedelta
 
 import streamlit as st
 
-from database import MatchReminder, get_session
-from points import add_points
-from ai_gateway import generate_task_suggestion
+import services
+from change_feed import live_fragment, load_when_changed
+from database import MatchReminder, get_read_session
+from query_cache import cached_query
+from ai_context import build_prompt_context
+from ai_gateway import stream_task_suggestion
 
 
 def create_match_task(title: str, opponent: str, match_date: datetime, location: str, created_by: str) -> bool:
-    session = get_session()
     try:
-        reminder = MatchReminder(
-            title=title,
-            opponent=opponent,
-            match_date=match_date,
-            location=location,
-            reminder_time=match_date - timedelta(hours=2),
-            is_completed=False,
-            created_by=created_by,
-            created_at=datetime.now(),
-        )
-        session.add(reminder)
-        session.commit()
+        services.run(services.create_match, title, opponent, match_date, location, created_by)
         return True
     except Exception as e:
         st.error(f"创建任务失败：{e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
 
 
+@cached_query("match_reminders")
 def get_match_tasks(show_completed: bool = False):
-    session = get_session()
+    session = get_read_session()
     try:
         query = session.query(MatchReminder)
         if not show_completed:
@@ -44,21 +33,11 @@ def get_match_tasks(show_completed: bool = False):
 
 
 def complete_match_task(task_id: int, user: str) -> bool:
-    session = get_session()
     try:
-        task = session.query(MatchReminder).filter(MatchReminder.id == task_id).first()
-        if not task:
-            return False
-        task.is_completed = True
-        session.commit()
-        add_points(user, 8, f"完成赛事任务：{task.title}")
-        return True
+        return services.run(services.complete_match, task_id, user) is not None
     except Exception as e:
         st.error(f"更新任务失败：{e}")
-        session.rollback()
         return False
-    finally:
-        session.close()
 
 
 
@@ -79,13 +58,37 @@ def render_ai_task_helper() -> None:
                 st.warning("请先输入需求")
             else:
                 try:
-                    output = generate_task_suggestion(prompt.strip())
+                    context = build_prompt_context()
+                    # 边生成边显示，不必等完整回复
+                    st.write_stream(stream_task_suggestion(prompt.strip(), context))
                     st.success("已生成建议")
-                    st.markdown(output)
                 except Exception as e:
                     st.error(f"调用 AI 失败：{e}")
 
 
+@live_fragment
+def render_pending_matches() -> None:
+    """待完成赛事；定时只重跑这一块，对方新建或完成赛事后自动更新。"""
+    st.markdown("### 待完成赛事")
+    tasks = load_when_changed("pending_matches", ("match_reminders",), get_match_tasks, False)
+    if tasks:
+        for task in tasks:
+            with st.container(border=True):
+                st.write(f"**{task.title}**")
+                st.caption(
+                    f"{task.match_date.strftime('%Y-%m-%d %H:%M')} · "
+                    f"地点：{task.location or '待定'} · 对手：{task.opponent or '待定'}"
+                )
+                created_by = "💕 我" if task.created_by == "me" else "🏸 他"
+                st.caption(f"创建人：{created_by} · 提醒：{task.reminder_time.strftime('%m-%d %H:%M')}")
+                if st.button("✅ 已完成", key=f"task_done_{task.id}", use_container_width=True):
+                    if complete_match_task(task.id, st.session_state.user):
+                        st.success("已标记完成 +8 积分")
+                        st.rerun()
+    else:
+        st.info("暂无待完成赛事。")
+
+
 def render_tasks() -> None:
     st.markdown("## 🏆 赛事任务")
     st.caption("把比赛安排公开透明，互相支持。")
@@ -108,24 +111,7 @@ def render_tasks() -> None:
                     st.rerun()
 
     with right:
-        st.markdown("### 待完成赛事")
-        tasks = get_match_tasks(show_completed=False)
-        if tasks:
-            for task in tasks:
-                with st.container(border=True):
-                    st.write(f"**{task.title}**")
-                    st.caption(
-                        f"{task.match_date.strftime('%Y-%m-%d %H:%M')} · "
-                        f"地点：{task.location or '待定'} · 对手：{task.opponent or '待定'}"
-                    )
-                    created_by = "💕 我" if task.created_by == "me" else "🏸 他"
-                    st.caption(f"创建人：{created_by} · 提醒：{task.reminder_time.strftime('%m-%d %H:%M')}")
-                    if st.button("✅ 已完成", key=f"task_done_{task.id}", use_container_width=True):
-                        if complete_match_task(task.id, st.session_state.user):
-                            st.success("已标记完成 +8 积分")
-                            st.rerun()
-        else:
-            st.info("暂无待完成赛事。")
+        render_pending_matches()
 
     render_ai_task_helper()
 
@@ -3,12 +3,77 @@
 """
 import plotly.graph_objects as go
 import plotly.express as px
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import numpy as np
 import pandas as pd
 
-def create_emotion_timeline(records):
-    """创建情绪时间线图（羽毛球场风格）"""
-    if not records:
+# 时间线整张图最多绘制的点数（两人合计，按 (时间桶, 发送者) 计数），超过后自动按更粗的时间粒度汇总
+TIMELINE_MAX_POINTS = 400
+# 点数超过该值时改用 WebGL（Scattergl）渲染，避免浏览器里上千个 SVG 节点卡顿
+WEBGL_THRESHOLD = 300
+
+# 汇总粒度（从细到粗）
+RESOLUTIONS = [
+    ('min', '分钟'),
+    ('h', '小时'),
+    ('D', '天'),
+    ('W', '周'),
+]
+
+def truncate_preview(frame, limit):
+    """按 content_length 给 SQL 截好的 preview 列整列加省略号（limit 不超过 SQL 截取长度）"""
+    preview = frame['preview'].str.slice(0, limit)
+    return preview.where(frame['content_length'] <= limit, preview + '...')
+
+def _bucket_start(times, freq):
+    if freq == 'W':
+        return times.dt.to_period('W').dt.start_time
+    return times.dt.floor(freq)
+
+def downsample_timeline(frame, max_points=TIMELINE_MAX_POINTS):
+    """把时间线数据压到 max_points 个点以内
+
+    从分钟到周逐级尝试，选第一个能让点数达标的粒度，按 (时间桶, 发送者) 求加权平均心情。
+    frame 可以带 entries 列（已汇总的条数，比如小时汇总表），没有则每行算 1 条。
+    返回 (frame, 粒度名)，没有降采样时粒度名为 None。
+    """
+    if len(frame) <= max_points:
+        return frame, None
+    
+    entries = frame['entries'] if 'entries' in frame else pd.Series(1, index=frame.index)
+    base = pd.DataFrame({
+        'sender': frame['sender'].astype(object),
+        'weighted': frame['emotion_score'] * entries,
+        'entries': entries,
+    })
+    
+    for freq, label in RESOLUTIONS:
+        grouped = base.assign(created_at=_bucket_start(frame['created_at'], freq)).groupby(
+            ['created_at', 'sender'], as_index=False, sort=True
+        )[['weighted', 'entries']].sum()
+        if len(grouped) <= max_points or freq == RESOLUTIONS[-1][0]:
+            break
+    
+    counts = grouped['entries'].astype('int64')
+    preview = counts.astype(str) + f'条·{label}均值'
+    return pd.DataFrame({
+        'created_at': grouped['created_at'],
+        'sender': grouped['sender'],
+        'action': None,
+        'emotion_score': (grouped['weighted'] / grouped['entries']).round(1),
+        'preview': preview,
+        'content_length': preview.str.len(),
+        'entries': counts,
+    }), label
+
+def create_emotion_timeline(frame, resolution=None):
+    """创建情绪时间线图（羽毛球场风格）
+
+    frame 为 court.get_timeline_frame 返回的列式数据
+    （created_at, sender, emotion_score, preview, content_length, action），
+    或 downsample_timeline 汇总后的数据（此时 resolution 为汇总粒度名）。
+    """
+    if frame.empty:
         # 返回空图
         fig = go.Figure()
         fig.update_layout(
@@ -18,16 +83,14 @@ def create_emotion_timeline(records):
         )
         return fig
     
-    # 准备数据
-    df = pd.DataFrame([
-        {
-            '时间': r.created_at,
-            '心情': r.emotion_score,
-            '发送者': '我' if r.sender == 'me' else '他',
-            '内容': r.content[:15] + '...' if len(r.content) > 15 else r.content,
-            '动作': r.action
-        } for r in records
-    ])
+    # 准备数据（整列运算，不逐行处理）
+    df = pd.DataFrame({
+        '时间': frame['created_at'],
+        '心情': frame['emotion_score'],
+        '发送者': np.where(frame['sender'] == 'me', '我', '他'),
+        '内容': truncate_preview(frame, 15),
+        '动作': frame['action']
+    })
     
     # 按时间排序
     df = df.sort_values('时间')
@@ -35,11 +98,15 @@ def create_emotion_timeline(records):
     # 创建颜色映射
     colors = {'我': '#ff69b4', '他': '#4169e1'}
     
+    # 点多时用 WebGL 渲染，并去掉每个点上的文字标签
+    use_webgl = len(df) > WEBGL_THRESHOLD
+    scatter = go.Scattergl if use_webgl else go.Scatter
+    
     # 创建图形
     fig = go.Figure()
     
     # 添加羽毛球轨迹线（用散点图连接）
-    fig.add_trace(go.Scatter(
+    fig.add_trace(scatter(
         x=df['时间'],
         y=df['心情'],
         mode='lines+markers',
@@ -53,10 +120,10 @@ def create_emotion_timeline(records):
     for sender in ['我', '他']:
         sender_df = df[df['发送者'] == sender]
         if not sender_df.empty:
-            fig.add_trace(go.Scatter(
+            fig.add_trace(scatter(
                 x=sender_df['时间'],
                 y=sender_df['心情'],
-                mode='markers+text',
+                mode='markers' if use_webgl else 'markers+text',
                 marker=dict(
                     size=12,
                     color=colors[sender],
@@ -78,7 +145,7 @@ def create_emotion_timeline(records):
     # 更新布局为球场风格
     fig.update_layout(
         title=dict(
-            text="🏸 爱的球路轨迹",
+            text="🏸 爱的球路轨迹" + (f"（按{resolution}汇总）" if resolution else ""),
             font=dict(size=20, color='white')
         ),
         plot_bgcolor='rgba(27, 77, 27, 0.3)',  # 球场绿半透明
@@ -119,29 +186,19 @@ def create_emotion_timeline(records):
     
     return fig
 
-def create_emotion_heatmap(records, days=30):
-    """创建情绪热力图（显示每个时间段的情绪）"""
-    if not records:
+def create_emotion_heatmap(cells, days=30):
+    """创建情绪热力图（显示每个时间段的情绪）
+
+    cells 为 rollups.get_emotion_heatmap_cells(days) 返回的小时格子（day, hour, score_sum, entries），
+    只包含请求窗口内有记录的格子；图上画满最近 days 天 × 24 小时，没有记录的格子留空。
+    """
+    if cells.empty:
         return go.Figure()
     
-    # 准备数据
-    df = pd.DataFrame([
-        {
-            '日期': r.created_at.date(),
-            '小时': r.created_at.hour,
-            '心情': r.emotion_score
-        } for r in records
-    ])
-    
-    # 创建透视表
-    pivot = pd.pivot_table(
-        df,
-        values='心情',
-        index='小时',
-        columns='日期',
-        aggfunc='mean',
-        fill_value=0
-    )
+    # 格子已经按 (日期, 小时) 汇总好，这里只需要摊成 小时 × 日期 的矩阵
+    all_days = [date.today() - timedelta(days=n) for n in range(days - 1, -1, -1)]
+    cells = cells.assign(心情=cells['score_sum'] / cells['entries'])
+    pivot = cells.pivot(index='hour', columns='day', values='心情').reindex(index=range(24), columns=all_days)
     
     # 创建热力图
     fig = go.Figure(data=go.Heatmap(
@@ -149,6 +206,7 @@ def create_emotion_heatmap(records, days=30):
         x=pivot.columns,
         y=pivot.index,
         colorscale='Viridis',
+        hoverongaps=False,
         hovertemplate='日期: %{x}<br>时间: %{y}:00<br>平均心情: %{z:.1f}<extra></extra>'
     ))
     
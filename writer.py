@@ -0,0 +1,125 @@
+"""
+后台写入线程 - 把多个请求的写操作合并成短批次事务
+
+SQLite 同一时间只有一个写者，每个页面线程各自提交会在文件锁上排队、每行付一次 fsync。
+开启后（CRUSHCOURT_WRITE_QUEUE=1），services.submit 把写命令放进队列，
+写线程在 max_delay 内尽量凑满一批，逐条用 SAVEPOINT 执行后一次提交，
+调用方通过 Future 拿到各自的结果或异常。
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from database import get_session
+
+_STOP = object()
+
+
+@dataclass
+class WriteCommand:
+    action: object  # action(session, *args, **kwargs)
+    args: tuple
+    kwargs: dict
+    future: Future = field(default_factory=Future)
+
+
+class WriteQueue:
+    """单线程写入队列。"""
+
+    def __init__(self, max_batch: int = 64, max_delay: float = 0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="crushcourt-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, action, *args, **kwargs) -> Future:
+        command = WriteCommand(action, args, kwargs)
+        self._queue.put(command)
+        return command.future
+
+    def close(self, timeout: float = 5.0) -> None:
+        """处理完已入队的命令后停止写线程。"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            command = self._queue.get()
+            if command is _STOP:
+                return
+
+            batch = [command]
+            stopping = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    command = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if command is _STOP:
+                    stopping = True
+                    break
+                batch.append(command)
+
+            self._execute(batch)
+            if stopping:
+                return
+
+    def _execute(self, batch) -> None:
+        commands = [c for c in batch if c.future.set_running_or_notify_cancel()]
+        if not commands:
+            return
+
+        outcomes = []
+        session = get_session()
+        try:
+            for command in commands:
+                # 每条命令一个 SAVEPOINT：单条失败只回滚它自己，不影响同批其他命令
+                try:
+                    with session.begin_nested():
+                        result = command.action(session, *command.args, **command.kwargs)
+                    outcomes.append((command, result, None))
+                except Exception as e:
+                    outcomes.append((command, None, e))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for command in commands:
+                command.future.set_exception(e)
+            return
+        finally:
+            session.close()
+
+        for command, result, error in outcomes:
+            if error is None:
+                command.future.set_result(result)
+            else:
+                command.future.set_exception(error)
+
+
+_write_queue = None
+_lock = threading.Lock()
+
+
+def write_queue_enabled() -> bool:
+    return os.getenv("CRUSHCOURT_WRITE_QUEUE", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_write_queue() -> WriteQueue:
+    """进程内唯一的写入队列，首次调用时启动。"""
+    global _write_queue
+    if _write_queue is None:
+        with _lock:
+            if _write_queue is None:
+                _write_queue = WriteQueue(
+                    max_batch=int(os.getenv("CRUSHCOURT_WRITE_QUEUE_BATCH", "64")),
+                    max_delay=float(os.getenv("CRUSHCOURT_WRITE_QUEUE_DELAY_MS", "5")) / 1000,
+                )
+                atexit.register(_write_queue.close)
+    return _write_queue